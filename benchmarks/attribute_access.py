@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the cost of ``db.Task`` and ``db['tasks']`` with the per context
+    cache of :class:`flask_mongokit.MongoKit` against the uncached resolution
+    over the MongoKit database. Requires a running MongoDB on localhost.
+
+        $ python benchmarks/attribute_access.py
+"""
+import timeit
+from datetime import datetime
+
+from flask import Flask
+from flask_mongokit import MongoKit, Document, ctx_stack
+
+NUMBER = 100000
+
+
+class Task(Document):
+    __collection__ = 'tasks'
+    structure = {
+        'title': unicode,
+        'text': unicode,
+        'creation': datetime,
+    }
+    required_fields = ['title', 'creation']
+    default_values = {'creation': datetime.utcnow}
+    use_dot_notation = True
+
+app = Flask(__name__)
+app.config['MONGODB_DATABASE'] = 'flask_benchmark'
+db = MongoKit(app)
+db.register([Task])
+
+
+def uncached_attribute():
+    return getattr(ctx_stack.top.mongokit_database, 'Task')
+
+
+def uncached_item():
+    return ctx_stack.top.mongokit_database['tasks']
+
+
+def cached_attribute():
+    return db.Task
+
+
+def cached_item():
+    return db['tasks']
+
+
+def run(func):
+    seconds = timeit.timeit(func, number=NUMBER)
+    print "%-20s %8.3f us per access" % (func.__name__,
+                                          seconds / NUMBER * 1000000)
+
+if __name__ == '__main__':
+    with app.test_request_context('/'):
+        db.connect()
+        for func in (uncached_attribute, cached_attribute,
+                     uncached_item, cached_item):
+            run(func)
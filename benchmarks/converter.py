@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares :class:`flask_mongokit.BSONObjectIdConverter` against the
+    previous converter, which built the ids with :class:`bson.ObjectId` and
+    caught :class:`bson.errors.InvalidId`. Werkzeug passes the values of an
+    URL as :class:`unicode`, so both :class:`str` and :class:`unicode` input
+    is measured. No MongoDB is needed.
+
+        $ python benchmarks/converter.py
+"""
+import timeit
+
+import bson
+from flask import abort
+from werkzeug.routing import BaseConverter, Map
+from flask_mongokit import BSONObjectIdConverter
+
+NUMBER = 100000
+ROUNDS = 5
+
+
+class OldBSONObjectIdConverter(BaseConverter):
+    def to_python(self, value):
+        try:
+            return bson.ObjectId(value)
+        except bson.errors.InvalidId:
+            raise abort(400)
+
+    def to_url(self, value):
+        return str(value)
+
+url_map = Map()
+old = OldBSONObjectIdConverter(url_map)
+new = BSONObjectIdConverter(url_map)
+object_id = bson.ObjectId()
+hex_id = str(object_id)
+
+
+def run(name, func, value):
+    best = min(timeit.repeat(lambda: func(value), number=NUMBER,
+                             repeat=ROUNDS))
+    print "%-24s %8.3f us per call" % (name, best / NUMBER * 1000000)
+
+if __name__ == '__main__':
+    run('to_python str old', old.to_python, hex_id)
+    run('to_python str new', new.to_python, hex_id)
+    run('to_python unicode old', old.to_python, unicode(hex_id))
+    run('to_python unicode new', new.to_python, unicode(hex_id))
+    run('to_url old', old.to_url, object_id)
+    run('to_url new', new.to_url, object_id)
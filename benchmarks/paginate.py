@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the time to load one page at different depths with keyset
+    pagination of :meth:`flask_mongokit.Document.paginate` and with
+    :meth:`~pymongo.cursor.Cursor.skip`. Requires a running MongoDB on
+    localhost. The collection is filled with the given number of documents
+    on the first run.
+
+        $ python benchmarks/paginate.py 10000000
+"""
+import sys
+import time
+
+from flask import Flask
+from flask_mongokit import MongoKit, Document
+
+PER_PAGE = 50
+
+
+class Item(Document):
+    __collection__ = 'paginate_items'
+    structure = {
+        'number': int,
+    }
+    use_dot_notation = True
+
+app = Flask(__name__)
+app.config['MONGODB_DATABASE'] = 'flask_benchmark'
+app.config['MONGODB_MAX_PER_PAGE'] = PER_PAGE
+db = MongoKit(app)
+db.register([Item])
+
+
+def fill(count):
+    collection = db.paginate_items
+    existing = collection.count()
+    batch = []
+    for number in xrange(existing, count):
+        batch.append({'number': number})
+        if len(batch) == 10000:
+            collection.insert(batch)
+            batch = []
+    if batch:
+        collection.insert(batch)
+
+
+def page_token(depth):
+    """The token of the page at ``depth`` without paging through all
+    previous pages."""
+    last = db.paginate_items.find().sort('_id', 1).skip(depth - 1).limit(1)
+    return db.Item.paginate({'_id': {'$gte': list(last)[0]['_id']}},
+                            per_page=1).next_token
+
+
+def measure(func):
+    start = time.time()
+    func()
+    return (time.time() - start) * 1000
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with app.test_request_context('/'):
+        fill(count)
+        print "%12s %12s %12s" % ('depth', 'skip (ms)', 'keyset (ms)')
+        depth = PER_PAGE
+        while depth < count:
+            token = page_token(depth)
+            skip = measure(lambda: list(db.Item.find().sort('_id', 1)
+                                        .skip(depth).limit(PER_PAGE)))
+            keyset = measure(lambda: db.Item.paginate(per_page=PER_PAGE,
+                                                      after=token))
+            print "%12d %12.2f %12.2f" % (depth, skip, keyset)
+            depth *= 10
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the per document overhead of reading documents through
+    :class:`flask_mongokit.Document` against ``raw=True``, which returns the
+    plain dicts of the driver. Requires a running MongoDB on localhost.
+
+        $ python benchmarks/raw.py
+"""
+import time
+from datetime import datetime
+
+from flask import Flask
+from flask_mongokit import MongoKit, Document
+
+COUNT = 10000
+ROUNDS = 5
+
+
+class Task(Document):
+    __collection__ = 'raw_tasks'
+    structure = {
+        'title': unicode,
+        'text': unicode,
+        'tags': [unicode],
+        'creation': datetime,
+    }
+    use_dot_notation = True
+
+app = Flask(__name__)
+app.config['MONGODB_DATABASE'] = 'flask_benchmark'
+db = MongoKit(app)
+db.register([Task])
+
+
+def fill():
+    collection = db.raw_tasks
+    collection.remove()
+    collection.insert([{'title': u'Task %d' % number, 'text': u'Text',
+                        'tags': [u'a', u'b'], 'creation': datetime.utcnow()}
+                       for number in xrange(COUNT)])
+    return [doc['_id'] for doc in collection.find({}, {'_id': 1})]
+
+
+def find(raw):
+    return list(db.Task.find(raw=raw))
+
+
+def get(ids, raw):
+    for id in ids:
+        db.Task.get_or_404(id, raw=raw)
+
+
+def run(name, func, *args):
+    best = None
+    for _ in xrange(ROUNDS):
+        start = time.time()
+        func(*args)
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    print "%-20s %8.2f us per document" % (name, best / COUNT * 1000000)
+
+if __name__ == '__main__':
+    with app.test_request_context('/'):
+        ids = fill()
+        run('find wrapped', find, False)
+        run('find raw', find, True)
+        run('get_or_404 wrapped', get, ids[:1000] * 10, False)
+        run('get_or_404 raw', get, ids[:1000] * 10, True)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the peak memory and the time to the first byte of exporting a
+    collection with :func:`flask.jsonify` of a list and with
+    :func:`flask_mongokit.stream_json`. Every variant runs in its own
+    process, because the peak memory of a process never drops. Requires a
+    running MongoDB on localhost. The collection is filled with the given
+    number of documents on the first run.
+
+        $ python benchmarks/stream.py 1000000
+"""
+import sys
+import time
+import resource
+import subprocess
+from datetime import datetime
+
+from flask import Flask, jsonify
+from flask_mongokit import MongoKit, Document, stream_json
+
+
+class Row(Document):
+    __collection__ = 'stream_rows'
+    structure = {
+        'number': int,
+        'title': unicode,
+        'creation': datetime,
+    }
+    use_dot_notation = True
+
+app = Flask(__name__)
+app.config['MONGODB_DATABASE'] = 'flask_benchmark'
+db = MongoKit(app)
+db.register([Row])
+
+
+@app.route('/list')
+def export_list():
+    return jsonify(rows=list(db.Row.find({}, {'_id': 0})))
+
+
+@app.route('/stream')
+def export_stream():
+    return stream_json(db.Row.find({}, {'_id': 0}))
+
+
+@app.route('/ndjson')
+def export_ndjson():
+    return stream_json(db.Row.find({}, {'_id': 0}), ndjson=True)
+
+
+def fill(count):
+    with app.test_request_context('/'):
+        collection = db.stream_rows
+        existing = collection.count()
+        batch = []
+        for number in xrange(existing, count):
+            batch.append({'number': number, 'title': u'Row %d' % number,
+                          'creation': datetime.utcnow()})
+            if len(batch) == 10000:
+                collection.insert(batch)
+                batch = []
+        if batch:
+            collection.insert(batch)
+
+
+def run(url):
+    client = app.test_client()
+    start = time.time()
+    response = client.get(url, buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.time() - start
+        size += len(chunk)
+    total = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print "%-8s %12.1f %12.2f %12.2f %12d" % (url[1:], peak, first_byte,
+                                              total, size)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        run(sys.argv[2])
+    else:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+        fill(count)
+        print "%-8s %12s %12s %12s %12s" % ('variant', 'peak (MB)',
+                                             'first (s)', 'total (s)',
+                                             'bytes')
+        for url in ('/list', '/stream', '/ndjson'):
+            subprocess.check_call([sys.executable, __file__, str(count),
+                                   url])
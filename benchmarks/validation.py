@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+    Compares the structure validation and the construction with the
+    ``default_values`` of a document with the plan compiled by
+    :meth:`flask_mongokit.MongoKit.register` against the ones of MongoKit.
+    Only the validation of ``structure`` and ``required_fields`` is timed,
+    so no MongoDB is required.
+
+        $ python benchmarks/validation.py
+"""
+import timeit
+from datetime import datetime
+
+from flask import Flask
+from mongokit import SchemaDocument
+from flask_mongokit import MongoKit, Document, _validation_plans
+
+NUMBER = 20000
+
+
+class BlogPost(Document):
+    __collection__ = "posts"
+    structure = {
+        'title': unicode,
+        'body': unicode,
+        'author': unicode,
+        'date_creation': datetime,
+        'rank': int,
+        'tags': [unicode],
+    }
+    required_fields = ['title', 'author', 'date_creation']
+    default_values = {'rank': 0, 'date_creation': datetime.utcnow}
+    use_dot_notation = True
+
+
+class NestedBlogPost(BlogPost):
+    structure = {
+        'meta': {
+            'source': unicode,
+            'views': int,
+            'location': {'city': unicode, 'country': unicode},
+        },
+        'comments': [{'author': unicode, 'body': unicode, 'votes': int}],
+    }
+    required_fields = ['meta.source']
+    default_values = {
+        'meta.source': u'web',
+        'meta.views': 0,
+        'comments': [{'author': u'Flask-MongoKit', 'body': u'Welcome',
+                      'votes': 0}],
+    }
+
+app = Flask(__name__)
+app.config['MONGODB_DATABASE'] = 'flask_benchmark'
+app.config['MONGODB_LAZY_CONNECT'] = True
+db = MongoKit(app)
+db.register([BlogPost, NestedBlogPost])
+
+
+def create(document):
+    post = getattr(db, document.__name__)()
+    post.title = u'Flask-MongoKit'
+    post.body = u'Flask-MongoKit is a layer between Flask and MongoKit'
+    post.author = u'Christoph Heer'
+    post.tags = [u'flask', u'mongodb', u'mongokit']
+    if document is NestedBlogPost:
+        post.meta.source = u'web'
+        post.meta.views = 42
+        post.meta.location.city = u'Berlin'
+        post.meta.location.country = u'Germany'
+        post.comments = [{'author': u'Someone', 'body': u'Nice',
+                          'votes': i} for i in range(10)]
+    return post
+
+
+def run(document, compiled):
+    post = create(document)
+    plan = _validation_plans.pop(document)
+    try:
+        if compiled:
+            _validation_plans[document] = plan
+        validation = timeit.timeit(lambda: SchemaDocument.validate(post),
+                                   number=NUMBER)
+        construction = timeit.timeit(document, number=NUMBER)
+    finally:
+        _validation_plans[document] = plan
+    print "%-16s %-9s %8.2f us per validation %8.2f us per construction" % (
+        document.__name__, 'compiled' if compiled else 'mongokit',
+        validation / NUMBER * 1000000, construction / NUMBER * 1000000)
+
+if __name__ == '__main__':
+    with app.test_request_context('/'):
+        for document in (BlogPost, NestedBlogPost):
+            run(document, False)
+            run(document, True)
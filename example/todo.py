@@ -14,7 +14,7 @@ class Task(Document):
         'creation': datetime,
     }
     required_fields = ['title', 'creation']
-    default_values = {'creation': datetime.utcnow()}
+    default_values = {'creation': datetime.utcnow}
     use_dot_notation = True
 
 db = MongoKit(app)
@@ -23,7 +23,8 @@ db.register([Task])
 
 @app.route('/')
 def show_all():
-    tasks = db.Task.find()
+    tasks = db.Task.paginate_or_404(per_page=20,
+                                    after=request.args.get('after'))
     return render_template('list.html', tasks=tasks)
 
 
@@ -12,12 +12,48 @@
 
 from __future__ import absolute_import
 
+import os
+import re
+import sys
+import time
+import base64
+import binascii
+import bisect
+import threading
+import warnings
+from datetime import datetime, date
+from copy import deepcopy
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from urllib import quote_plus
+
+try:
+    from collections import OrderedDict
+except ImportError: # pragma: no cover
+    from ordereddict import OrderedDict
+
 import bson
-from mongokit import Connection, Database, Collection, Document
-from pymongo.errors import OperationFailure
+from mongokit import Connection, ReplicaSetConnection, Database, \
+                     Collection, Document
+from mongokit.cursor import Cursor
+from mongokit.operators import SchemaOperator
+from mongokit.schema_document import CustomType, STRUCTURE_KEYWORDS, \
+    AuthorizedTypeError, RequireFieldError, SchemaTypeError, StructureError
+from pymongo import ASCENDING, ReadPreference, MongoClient, \
+    MongoReplicaSetClient
+from pymongo.cursor import Cursor as PymongoCursor
+from pymongo.errors import OperationFailure, AutoReconnect, BulkWriteError
 
 from werkzeug.routing import BaseConverter
-from flask import abort, _request_ctx_stack
+from flask import abort, json, _request_ctx_stack
+from flask.signals import Namespace
+
+try: # pragma: no cover
+    from flask import stream_with_context
+except ImportError: # pragma: no cover
+    # Flask before 0.9
+    stream_with_context = None
 
 try: # pragma: no cover
     from flask import _app_ctx_stack
@@ -25,61 +61,1986 @@ try: # pragma: no cover
 except ImportError: # pragma: no cover
     ctx_stack = _request_ctx_stack
 
+_signals = Namespace()
+
+#: Sent at the end of a context with the recorded queries as ``queries`` if
+#: ``MONGODB_RECORD_QUERIES`` is enabled. The sender is the application.
+queries_recorded = _signals.signal('mongokit-queries-recorded')
+
 class AuthenticationIncorrect(Exception):
     pass
 
-class BSONObjectIdConverter(BaseConverter):
-    """A simple converter for the RESTfull URL routing system of Flask.
 
-    .. code-block:: python
+class PartialDocumentError(Exception):
+    """Raised on saving a document which was loaded with only some fields."""
+
+
+class NPlusOneWarning(UserWarning):
+    """Warned if a context sends a query with the same shape
+    ``MONGODB_N_PLUS_ONE_LIMIT`` times.
+    """
+
+
+class NPlusOneError(Exception):
+    """Raised instead of :class:`NPlusOneWarning` if
+    ``MONGODB_N_PLUS_ONE_ACTION`` is ``'raise'``.
+    """
+
+
+class QueryPlanWarning(UserWarning):
+    """Warned at the end of a context which sent queries without a fitting
+    index if ``MONGODB_EXPLAIN_QUERIES`` is enabled.
+    """
+
+
+class QueryPlanError(Exception):
+    """Raised by a query without a fitting index instead of the
+    :class:`QueryPlanWarning` if ``MONGODB_EXPLAIN_ACTION`` is ``'raise'``.
+    """
+
+
+class ValidationMismatchError(AssertionError):
+    """Raised if ``MONGODB_VALIDATION_CHECK`` is enabled and the compiled
+    validation of a document gives another result than the one of MongoKit.
+    """
+
+
+#: error codes of the server if a command is not authorized
+_AUTH_ERROR_CODES = (13, 18)
+
+
+def _is_auth_error(error):
+    if isinstance(error, AutoReconnect):
+        return True
+    return isinstance(error, OperationFailure) and \
+        getattr(error, 'code', None) in _AUTH_ERROR_CODES
+
+
+def _open_sockets(connection, count):
+    """Open ``count`` sockets of the pool of ``connection`` at once. Every
+    socket is bound to its own thread until all of them are connected and
+    then given back to the pool.
+    """
+    connected = threading.Semaphore(0)
+    done = threading.Event()
+    errors = []
+
+    def open_socket():
+        try:
+            try:
+                connection.start_request()
+                connection.admin.command('ping')
+            except Exception as e:
+                errors.append(e)
+        finally:
+            connected.release()
+        done.wait()
+        connection.end_request()
+
+    threads = [threading.Thread(target=open_socket) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        connected.acquire()
+    done.set()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+class _SharedConnection(object):
+    """A long-lived :class:`mongokit.Connection` which is shared by all
+    contexts of one application inside one process. The contexts only borrow
+    it and give it back at the end of the request.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.last_used = time.time()
+        #: number of :attr:`MongoKit.registered_documents` already registered
+        self.registered = 0
+        #: number of contexts which currently borrow this connection
+        self.in_use = 0
+        #: a retired connection will be closed by its last borrower
+        self.retired = False
+        #: the credentials are cached by the connection after the first
+        #: successful authentication
+        self.authenticated = False
+
+    def expired(self, now, idle_timeout, max_lifetime):
+        if max_lifetime and now - self.created > max_lifetime:
+            return True
+        if idle_timeout and not self.in_use and \
+           now - self.last_used > idle_timeout:
+            return True
+        return False
+
+    def close(self):
+        self.connection.disconnect()
+
+_OBJECT_ID_REGEX = '[0-9a-fA-F]{24}'
+_object_id_re = re.compile(_OBJECT_ID_REGEX + r'\Z')
+
+#: the hex strings of the ids of :meth:`BSONObjectIdConverter.to_url` by
+#: their binary. It's cleared if it reaches the maximum size.
+_object_id_hexes = {}
+_OBJECT_ID_HEXES_MAX_SIZE = 10000
+
+
+def _object_id_from_hex(value):
+    # the 12 bytes skip the slower validation of the hex string by bson
+    return bson.ObjectId(binascii.unhexlify(value))
+
+
+def _object_id_hex(value):
+    if type(value) is not bson.ObjectId:
+        return str(value)
+    binary = value.binary
+    hex_id = _object_id_hexes.get(binary)
+    if hex_id is None:
+        hex_id = binascii.hexlify(binary)
+        if len(_object_id_hexes) >= _OBJECT_ID_HEXES_MAX_SIZE:
+            _object_id_hexes.clear()
+        _object_id_hexes[binary] = hex_id
+    return hex_id
+
+
+class BSONObjectIdConverter(BaseConverter):
+    """A simple converter for the RESTfull URL routing system of Flask.
+
+    .. code-block:: python
+
+        @app.route('/<ObjectId:task_id>')
+        def show_task(task_id):
+            task = db.Task.get_from_id(task_id)
+            return render_template('task.html', task=task)
+
+    It checks the validate of the id and converts it into a
+    :class:`bson.objectid.ObjectId` object. The converter will be
+    automatically registered by the initialization of
+    :class:`~flask.ext.mongokit.MongoKit` with keyword :attr:`ObjectId`.
+
+    The route only matches 24 hex digits, so an URL with an invalid id is a
+    404 error of the router. :meth:`to_python` raises a 400 error for other
+    values.
+    """
+
+    regex = _OBJECT_ID_REGEX
+
+    def to_python(self, value):
+        if _object_id_re.match(value) is None:
+            abort(400)
+        return _object_id_from_hex(value)
+
+    def to_url(self, value):
+        return _object_id_hex(value)
+
+
+class BSONObjectIdListConverter(BaseConverter):
+    """Like :class:`BSONObjectIdConverter` for a comma separated list of ids
+    which is converted into a :class:`list` of
+    :class:`bson.objectid.ObjectId` objects, for example for
+    :meth:`Document.get_many_or_404`. It's registered with the keyword
+    :attr:`ObjectIds`.
+
+    .. code-block:: python
+
+        @app.route('/compare/<ObjectIds:task_ids>')
+        def compare_tasks(task_ids):
+            tasks = db.Task.get_many_or_404(task_ids)
+            return render_template('compare.html', tasks=tasks)
+    """
+
+    regex = '%s(?:,%s)*' % (_OBJECT_ID_REGEX, _OBJECT_ID_REGEX)
+
+    def to_python(self, value):
+        ids = value.split(',')
+        for id in ids:
+            if _object_id_re.match(id) is None:
+                abort(400)
+        return [_object_id_from_hex(id) for id in ids]
+
+    def to_url(self, value):
+        return ','.join([_object_id_hex(id) for id in value])
+
+
+class CacheBackend(object):
+    """Interface of the cache behind the ``__cache__`` attribute of
+    :class:`Document`. The values are the BSON encoded documents, so a shared
+    backend like memcached or redis only has to store strings:
+
+    .. code-block:: python
+
+        class RedisCache(CacheBackend):
+            def __init__(self, redis):
+                super(RedisCache, self).__init__()
+                self.redis = redis
+
+            def get(self, key):
+                return self.redis.get(key)
+
+            def set(self, key, value, ttl=None):
+                self.redis.set(key, value, ex=ttl)
+
+            def delete(self, key):
+                self.redis.delete(key)
+
+        class Task(Document):
+            __cache__ = {'ttl': 30, 'backend': RedisCache(redis)}
+
+    The counters :attr:`hits` and :attr:`misses` are maintained by
+    :class:`Document`, :attr:`evictions` by the backend itself.
+    """
+
+    def __init__(self):
+        #: number of lookups which were answered by the cache
+        self.hits = 0
+        #: number of lookups which had to query the server
+        self.misses = 0
+        #: number of entries dropped because the cache was full
+        self.evictions = 0
+        self._counters_lock = threading.Lock()
+
+    def _count(self, counter):
+        self._counters_lock.acquire()
+        try:
+            setattr(self, counter, getattr(self, counter) + 1)
+        finally:
+            self._counters_lock.release()
+
+    def get(self, key):
+        """Return the value of ``key`` or ``None``."""
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` for ``ttl`` seconds or forever."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Remove ``key`` if it is cached."""
+        raise NotImplementedError()
+
+    def stats(self):
+        """Return the counters as :class:`dict`."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class LRUCache(CacheBackend):
+    """An in-process :class:`CacheBackend` which drops the least recently
+    used entry when it holds more than ``max_entries`` entries.
+    """
+
+    def __init__(self, max_entries=10000):
+        super(LRUCache, self).__init__()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                return None
+            # move the entry to the end of the order
+            self._entries[key] = entry
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            expires = None
+        else:
+            expires = time.time() + ttl
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._entries.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache_backends = {}
+_cache_backends_lock = threading.Lock()
+
+
+def _document_class(doc):
+    """The registered document class behind the callable documents of the
+    connection."""
+    return getattr(type(doc), '_obj_class', type(doc))
+
+
+def _cache_backend(doc_class):
+    """Return the :class:`CacheBackend` of a document class with a
+    ``__cache__`` attribute or ``None``.
+    """
+    options = doc_class.__cache__
+    if not options:
+        return None
+    backend = _cache_backends.get(doc_class)
+    if backend is None:
+        _cache_backends_lock.acquire()
+        try:
+            backend = _cache_backends.get(doc_class)
+            if backend is None:
+                backend = options.get('backend')
+                if backend is None:
+                    backend = LRUCache(options.get('max_entries', 10000))
+                _cache_backends[doc_class] = backend
+        finally:
+            _cache_backends_lock.release()
+    return backend
+
+
+def _cache_key(collection, id):
+    # ids which are the same for MongoDB like 'abc' and u'abc' or 1 and 1L
+    # must get the same key
+    if isinstance(id, str):
+        id = id.decode('utf-8')
+    elif isinstance(id, long):
+        id = int(id)
+    return '%s:%r' % (collection.full_name, id)
+
+
+def _drop_cached(collection, spec):
+    """Drop the cached documents which an update or remove on
+    ``collection`` selects by ``_id``. A query by other fields can't be
+    mapped to the cached entries.
+    """
+    if not _cache_backends or not isinstance(spec, dict) or \
+       '_id' not in spec:
+        return
+    ids = spec['_id']
+    if isinstance(ids, dict):
+        if ids.keys() != ['$in']:
+            return
+        ids = ids['$in']
+    else:
+        ids = [ids]
+    for doc_class, cache in _cache_backends.items():
+        if doc_class.__collection__ == collection.name:
+            for id in ids:
+                cache.delete(_cache_key(collection, id))
+
+
+class Page(object):
+    """One page of :meth:`Document.paginate`. It can be iterated like the
+    list of its :attr:`items`.
+    """
+
+    def __init__(self, items, has_next, next_token):
+        #: the documents of this page
+        self.items = items
+        #: ``True`` if there are more documents after this page
+        self.has_next = has_next
+        #: the opaque token of the next page for the ``after`` parameter
+        #: or ``None`` if this is the last page
+        self.next_token = next_token
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _get_path(doc, key):
+    for part in key.split('.'):
+        doc = doc.get(part) if doc is not None else None
+    return doc
+
+
+def _encode_page_token(value, id):
+    return base64.urlsafe_b64encode(bson.BSON.encode({'v': value, 'i': id}))
+
+
+def _decode_page_token(token):
+    try:
+        data = bson.BSON(base64.urlsafe_b64decode(str(token))).decode()
+        return data['v'], data['i']
+    except Exception:
+        raise ValueError('Invalid page token %r' % token)
+
+
+def _keyset(sort_key, value, id, direction):
+    """Return the query for the documents after ``value`` and ``id`` in the
+    order of ``sort_key`` and ``_id``. ``null`` and missing values are
+    sorted before all others, but ``$gt`` and ``$lt`` only compare values
+    of the same type, so they are handled explicitly.
+    """
+    if direction == ASCENDING:
+        operator = '$gt'
+    else:
+        operator = '$lt'
+    if sort_key == '_id':
+        return {'_id': {operator: id}}
+    same_value = {sort_key: value, '_id': {operator: id}}
+    if value is None:
+        if direction == ASCENDING:
+            return {'$or': [{sort_key: {'$ne': None}}, same_value]}
+        return same_value
+    keyset = [{sort_key: {operator: value}}, same_value]
+    if direction != ASCENDING:
+        keyset.append({sort_key: None})
+    return {'$or': keyset}
+
+
+#: marker for a query which isn't a plain lookup of one _id
+_no_id = object()
+
+
+def _id_from_query(args, kwargs):
+    """Return the id if the query arguments of ``find_one`` only look up
+    a single ``_id``.
+    """
+    if len(args) != 1 or kwargs:
+        return _no_id
+    spec = args[0]
+    if isinstance(spec, dict):
+        if len(spec) != 1 or '_id' not in spec or \
+           isinstance(spec['_id'], dict):
+            return _no_id
+        return spec['_id']
+    if spec is None:
+        return _no_id
+    return spec
+
+
+def _identity_map():
+    """The identity map of the current context or ``None`` if it is not
+    enabled with ``MONGODB_IDENTITY_MAP``.
+    """
+    return getattr(ctx_stack.top, 'mongokit_identity_map', None)
+
+
+def _identity_key(doc, id):
+    # documents of several classes can share a collection and each class
+    # gets its own instance
+    return (_document_class(doc), doc.collection.full_name, id)
+
+
+def _forget_identity(identity_map, collection_name, id):
+    """Remove the instances of all document classes of one document from
+    the identity map."""
+    for key in identity_map.keys():
+        if key[1] == collection_name and key[2] == id:
+            identity_map.pop(key, None)
+
+
+#: the read preferences by their name in the MongoDB documentation
+_READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+
+def _resolve_read_preference(read_preference):
+    if isinstance(read_preference, basestring):
+        try:
+            return _READ_PREFERENCES[read_preference]
+        except KeyError:
+            raise ValueError('Unknown read preference %r' % read_preference)
+    return read_preference
+
+
+def _read_preference(doc_class):
+    """The read preference of the current context which overrides the
+    ``__read_preference__`` of ``doc_class``, or ``None`` to use the one of
+    the connection.
+    """
+    read_preference = getattr(ctx_stack.top, 'mongokit_read_preference', None)
+    if read_preference is None:
+        read_preference = getattr(doc_class, '__read_preference__', None)
+    if read_preference is None:
+        return None
+    return _resolve_read_preference(read_preference)
+
+
+def _join_hosts(host, port):
+    """Return a list of hosts as the comma separated ``host:port`` pairs of
+    a MongoDB URI.
+    """
+    if isinstance(host, basestring):
+        host = host.split(',')
+    return ','.join(':' in item and item or '%s:%s' % (item, port)
+                    for item in host)
+
+
+def _add_credentials(uri, username, password, database):
+    """Return the MongoDB URI with the credentials and the database to
+    authenticate against. A URI which already carries credentials is
+    returned as it is.
+    """
+    hosts, slash, path = uri[len('mongodb://'):].partition('/')
+    if '@' in hosts:
+        return uri
+    if not path or path.startswith('?'):
+        path = database + path
+    return 'mongodb://%s:%s@%s/%s' % (quote_plus(username),
+                                      quote_plus(password or ''),
+                                      hosts, path)
+
+
+def _declared_indexes(document):
+    """Yield the keys and options of the ``indexes`` of a document class
+    like :meth:`mongokit.Document.generate_index` creates them.
+    """
+    for index in document.indexes or []:
+        options = dict(index)
+        fields = options.pop('fields', [])
+        if isinstance(fields, tuple):
+            keys = [fields]
+        elif isinstance(fields, basestring):
+            keys = [(fields, 1)]
+        else:
+            keys = [isinstance(field, basestring) and (field, 1) or field
+                    for field in fields]
+        # the cache time of ensure_index and a flag of the validation
+        options.pop('ttl', None)
+        options.pop('check', None)
+        yield _index_key(keys), options
+
+
+def _index_key(keys):
+    # the server returns the directions as floats
+    return [(field, isinstance(direction, float) and int(direction)
+             or direction) for field, direction in keys]
+
+
+def _index_options(options):
+    # the options which change the content of an index and need a rebuild
+    expire = options.get('expireAfterSeconds')
+    if expire is not None:
+        expire = int(expire)
+    return (bool(options.get('unique')), bool(options.get('sparse')), expire)
+
+
+class QueryRecord(object):
+    """One operation which was sent to the server in the current context.
+    The records are returned by :func:`get_debug_queries`.
+    """
+
+    def __init__(self, collection, operation, spec, duration, documents):
+        #: The full name of the collection like ``flask.tasks``
+        self.collection = collection
+        #: The name of the operation like ``find`` or ``update``. The further
+        #: batches of a ``find`` cursor are recorded as ``get_more``.
+        self.operation = operation
+        #: The filter of the operation
+        self.spec = spec
+        #: The time of the operation in seconds
+        self.duration = duration
+        #: The number of documents which were returned or ``None``
+        self.documents = documents
+
+    @property
+    def shape(self):
+        """The filter with every value replaced by ``?``."""
+        return _query_shape(self.spec)
+
+    def __repr__(self):
+        return '<QueryRecord %s %s %s %.1fms>' % (
+            self.operation, self.collection, self.shape,
+            self.duration * 1000
+        )
+
+
+def _query_shape(spec):
+    if isinstance(spec, dict):
+        return '{%s}' % ', '.join('%s: %s' % (key, _query_shape(spec[key]))
+                                  for key in sorted(spec))
+    if isinstance(spec, (list, tuple)) and spec and \
+       all(isinstance(item, dict) for item in spec):
+        # the clauses of $and, $or and $nor
+        return '[%s]' % ', '.join(_query_shape(item) for item in spec)
+    if spec is None:
+        return '{}'
+    return '?'
+
+
+def _trace(collection, operation, spec, func, *args, **kwargs):
+    """Call ``func`` and record it as ``operation`` if the current context
+    records queries. Otherwise it costs only one attribute lookup.
+    """
+    ctx = ctx_stack.top
+    recorder = getattr(ctx, 'mongokit_recorder', None)
+    if recorder is None:
+        return func(*args, **kwargs)
+
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except AutoReconnect:
+        recorder._record_reconnect(ctx)
+        raise
+    duration = time.time() - start
+    if operation in ('find', 'find_one'):
+        documents = result
+    else:
+        documents = None
+    recorder._record_query(ctx, QueryRecord(collection.full_name, operation,
+                                            spec, duration, documents),
+                           collection)
+    return result
+
+
+def _plan_problem(plan, max_ratio):
+    """Return why the explain ``plan`` of a query is bad or ``None``."""
+    if 'queryPlanner' in plan:
+        # MongoDB 3.0 and later
+        stages = [plan['queryPlanner']['winningPlan']]
+        while stages:
+            stage = stages.pop()
+            if stage.get('stage') == 'COLLSCAN':
+                return 'collection scan'
+            if 'inputStage' in stage:
+                stages.append(stage['inputStage'])
+            stages.extend(stage.get('inputStages', []))
+        stats = plan.get('executionStats', {})
+        examined = max(stats.get('totalKeysExamined', 0),
+                       stats.get('totalDocsExamined', 0))
+        returned = stats.get('nReturned', 0)
+    else:
+        if plan.get('cursor', '').startswith('BasicCursor'):
+            return 'collection scan'
+        examined = max(plan.get('nscanned', 0),
+                       plan.get('nscannedObjects', 0))
+        returned = plan.get('n', 0)
+
+    if max_ratio and examined > max_ratio * max(returned, 1):
+        return '%d documents examined for %d returned' % (examined, returned)
+    return None
+
+
+#: modules which are skipped to find the code which sent a query
+_INTERNAL_MODULES = ('flask_mongokit', 'mongokit', 'pymongo', 'bson',
+                     'concurrent')
+
+
+def _call_site():
+    """Return the file, line and function of the frame outside of this
+    extension and the drivers which sent the current query.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module.split('.')[0] not in _INTERNAL_MODULES:
+            return (frame.f_code.co_filename, frame.f_lineno,
+                    frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+def get_debug_queries():
+    """Return the list of :class:`QueryRecord` of the current context. It's
+    empty if ``MONGODB_RECORD_QUERIES`` isn't enabled.
+    """
+    return getattr(ctx_stack.top, 'mongokit_queries', None) or []
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label(value))
+                             for name, value in labels)
+
+
+def _socket_pools(connection):
+    # the pools are internals of the driver which are only created with
+    # the first socket, one per member of a replica set. An unknown
+    # attribute of a connection is a database, so check the class first.
+    if isinstance(connection, MongoReplicaSetClient):
+        members = connection._MongoReplicaSetClient__rs_state.members
+        return [member.pool for member in members]
+    if isinstance(connection, MongoClient):
+        member = connection._MongoClient__member
+        if member is not None:
+            return [member.pool]
+    return []
+
+
+def _idle_sockets(connection):
+    return sum([len(pool.sockets) for pool in _socket_pools(connection)])
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """In-process registry of the pool and query metrics of a
+    :class:`MongoKit` instance which is available as :attr:`MongoKit.metrics`.
+    The metrics are only collected if ``MONGODB_METRICS`` is enabled.
+    :meth:`render` returns them in the text format of `Prometheus`_ and the
+    registry itself is a WSGI application which serves them:
+
+    .. code-block:: python
+
+        from werkzeug.wsgi import DispatcherMiddleware
+
+        app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
+            '/metrics': db.metrics
+        })
+
+    .. _Prometheus: http://prometheus.io/
+    """
+
+    #: upper bounds in seconds of the buckets of the query histograms
+    buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    #: content type of :meth:`render`
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, mongokit=None):
+        self._mongokit = mongokit
+        self._lock = threading.Lock()
+        #: number of checkouts of shared connections by a context
+        self.checkouts = 0
+        #: seconds spent to check out shared connections, which includes
+        #: the wait for the lock of the extension and the creation of new
+        #: connections but not the wait for a socket of the driver
+        self.checkout_seconds = 0.0
+        #: number of connections opened to the server
+        self.connections = 0
+        #: number of operations which failed with
+        #: :exc:`~pymongo.errors.AutoReconnect`
+        self.reconnects = 0
+        #: number of authentications with the server
+        self.auth_handshakes = 0
+        #: histograms of the duration of the queries by collection and
+        #: operation
+        self.latency = {}
+
+    def _increment(self, name, value=1):
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + value)
+        finally:
+            self._lock.release()
+
+    def observe_query(self, query):
+        """Add the duration of a :class:`QueryRecord` to its histogram."""
+        key = (query.collection, query.operation)
+        self._lock.acquire()
+        try:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = _Histogram(self.buckets)
+            histogram.observe(query.duration)
+        finally:
+            self._lock.release()
+
+    def pools(self):
+        """Return the state of the shared connections as a list of
+        :class:`dict` with the name of the ``app``, its ``bind``, the number
+        of contexts which borrow it as ``borrowers`` and the number of
+        ``idle_sockets`` in the pools of the driver of all its members. The
+        driver doesn't expose the sockets in use, a borrowing context holds
+        at most one socket per member at a time.
+        """
+        if self._mongokit is None:
+            return []
+        shared_connections = self._mongokit._shared_connections
+        return [{'app': app.name, 'bind': bind, 'borrowers': shared.in_use,
+                 'idle_sockets': _idle_sockets(shared.connection)}
+                for (app, bind), shared in shared_connections.items()]
+
+    def render(self):
+        """Return all metrics in the text format of Prometheus."""
+        lines = []
+
+        def metric(name, type, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, type))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %r' % (name, suffix,
+                                            _format_labels(labels), value))
+
+        metric('mongokit_shared_connection_checkouts_total', 'counter',
+               'Number of checkouts of shared connections by a context.',
+               [('', (), self.checkouts)])
+        metric('mongokit_shared_connection_checkout_seconds_total', 'counter',
+               'Seconds spent to check out or create shared connections.',
+               [('', (), self.checkout_seconds)])
+        pools = self.pools()
+        metric('mongokit_shared_connection_borrowers', 'gauge',
+               'Number of contexts which borrow the shared connection.',
+               [('', (('app', pool['app']), ('bind', pool['bind'] or '')),
+                 pool['borrowers']) for pool in pools])
+        metric('mongokit_pool_idle_sockets', 'gauge',
+               'Number of idle sockets in the pools of the driver.',
+               [('', (('app', pool['app']), ('bind', pool['bind'] or '')),
+                 pool['idle_sockets']) for pool in pools])
+        metric('mongokit_connections_total', 'counter',
+               'Number of connections opened to the server.',
+               [('', (), self.connections)])
+        metric('mongokit_reconnects_total', 'counter',
+               'Number of operations which failed with AutoReconnect.',
+               [('', (), self.reconnects)])
+        metric('mongokit_auth_handshakes_total', 'counter',
+               'Number of authentications with the server.',
+               [('', (), self.auth_handshakes)])
+
+        samples = []
+        self._lock.acquire()
+        try:
+            for (collection, operation), histogram in \
+                    sorted(self.latency.items()):
+                labels = (('collection', collection),
+                          ('operation', operation))
+                count = 0
+                for bound, bucket in zip(self.buckets + ('+Inf',),
+                                         histogram.counts):
+                    count += bucket
+                    samples.append(('_bucket', labels + (('le', str(bound)),),
+                                    count))
+                samples.append(('_sum', labels, histogram.sum))
+                samples.append(('_count', labels, histogram.count))
+        finally:
+            self._lock.release()
+        metric('mongokit_query_duration_seconds', 'histogram',
+               'Duration of the queries by collection and operation.',
+               samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        body = self.render()
+        start_response('200 OK', [('Content-Type', self.content_type),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class Cursor(Cursor):
+    """A :class:`mongokit.cursor.Cursor` which records every batch that is
+    fetched from the server.
+    """
+
+    def _refresh(self):
+        if len(self._Cursor__data) or self._Cursor__killed:
+            # nothing to fetch
+            return super(Cursor, self)._refresh()
+        if self._Cursor__id is not None:
+            # the next batch of a query which was already sent
+            operation = 'get_more'
+        # find_one of pymongo is the only one which uses a limit of -1
+        elif self._Cursor__limit == -1:
+            operation = 'find_one'
+        else:
+            operation = 'find'
+        return _trace(self._Cursor__collection, operation,
+                      self._Cursor__spec, super(Cursor, self)._refresh)
+
+    def count(self, with_limit_and_skip=False):
+        return _trace(self._Cursor__collection, 'count', self._Cursor__spec,
+                      super(Cursor, self).count, with_limit_and_skip)
+
+    def distinct(self, key):
+        return _trace(self._Cursor__collection, 'distinct',
+                      self._Cursor__spec, super(Cursor, self).distinct, key)
+
+
+class Collection(Collection):
+    """A :class:`mongokit.Collection` which records its operations."""
+
+    def __getattr__(self, key):
+        if key in self._registered_documents:
+            return super(Collection, self).__getattr__(key)
+        newkey = u'%s.%s' % (self.name, key)
+        if newkey not in self._collections:
+            self._collections[newkey] = Collection(self.database, newkey)
+        return self._collections[newkey]
+
+    def find(self, *args, **kwargs):
+        if 'read_preference' not in kwargs:
+            read_preference = _read_preference(kwargs.get('wrap'))
+            if read_preference is not None:
+                kwargs['read_preference'] = read_preference
+        for option in ('slave_okay', 'read_preference', 'tag_sets',
+                       'secondary_acceptable_latency_ms'):
+            if option not in kwargs and hasattr(self, option):
+                kwargs[option] = getattr(self, option)
+        return Cursor(self, *args, **kwargs)
+
+    def insert(self, doc_or_docs, *args, **kwargs):
+        return _trace(self, 'insert', None, super(Collection, self).insert,
+                      doc_or_docs, *args, **kwargs)
+
+    def update(self, spec, document, *args, **kwargs):
+        result = _trace(self, 'update', spec, super(Collection, self).update,
+                        spec, document, *args, **kwargs)
+        _drop_cached(self, spec)
+        return result
+
+    def remove(self, spec_or_id=None, *args, **kwargs):
+        spec = spec_or_id
+        if spec is not None and not isinstance(spec, dict):
+            spec = {'_id': spec}
+        result = _trace(self, 'remove', spec,
+                        super(Collection, self).remove,
+                        spec_or_id, *args, **kwargs)
+        _drop_cached(self, spec)
+        return result
+
+    def find_and_modify(self, query={}, *args, **kwargs):
+        result = _trace(self, 'find_and_modify', query,
+                        super(Collection, self).find_and_modify,
+                        query, *args, **kwargs)
+        _drop_cached(self, query)
+        return result
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        return _trace(self, 'aggregate', None,
+                      super(Collection, self).aggregate,
+                      pipeline, *args, **kwargs)
+
+
+class Database(Database):
+    """A :class:`mongokit.Database` which hands out the recording
+    :class:`Collection`.
+    """
+
+    def __getattr__(self, key):
+        if key in self.connection._registered_documents:
+            document = self.connection._registered_documents[key]
+            return getattr(self[document.__collection__], key)
+        if key not in self._collections:
+            self._collections[key] = Collection(self, key)
+        return self._collections[key]
+
+
+_validation_plans = {}
+
+
+class _ValidationPlan(object):
+    """The ``structure``, ``required_fields`` and ``default_values`` of a
+    registered document class compiled by :meth:`MongoKit.register`. A part
+    which uses a construct the plan doesn't know like custom types,
+    operators, tuples or i18n is ``None`` and handled by MongoKit as before.
+    """
+
+    def __init__(self, document):
+        self.check = None
+        self.required = None
+        self.defaults = None
+        self.custom_types = _has_custom_types(document.structure)
+        if document.i18n or document.structure is None:
+            return
+        self.check = _compile_structure(document.structure, '')
+        self.required = _compile_required(document.structure,
+                                          document.required_fields or [])
+        if not self.custom_types:
+            self.defaults = _compile_defaults(document.structure,
+                                              document.default_values or {})
+
+
+def _has_custom_types(struct):
+    if isinstance(struct, (CustomType, SchemaOperator)):
+        return True
+    if isinstance(struct, dict):
+        for key, value in struct.items():
+            if type(key) is type or _has_custom_types(value):
+                return True
+    elif isinstance(struct, (list, tuple)):
+        for value in struct:
+            if _has_custom_types(value):
+                return True
+    return False
+
+
+def _compile_structure(struct, path):
+    """Return a function ``check(doc, value)`` which validates ``value``
+    like ``SchemaDocument._validate_doc`` with ``struct`` or ``None`` if
+    the structure can't be compiled. The checks of plain types are inlined
+    into the check of their dict and the paths are built only once.
+    """
+    if struct is None:
+        def check(doc, value):
+            if type(value) not in doc.authorized_types:
+                name = type(value).__name__
+                doc._raise_exception(AuthorizedTypeError, name,
+                                     "%s is not an authorized types" % name)
+        return check
+    if type(struct) is type:
+        def check(doc, value):
+            if not isinstance(value, struct) and value is not None:
+                doc._raise_exception(
+                    SchemaTypeError, path,
+                    "%s must be an instance of %s not %s" % (
+                        path, struct.__name__, type(value).__name__))
+        return check
+    if isinstance(struct, (CustomType, SchemaOperator)):
+        return None
+    if isinstance(struct, dict):
+        return _compile_dict(struct, path)
+    if isinstance(struct, list):
+        return _compile_list(struct, path)
+    return None
+
+
+def _compile_dict(struct, path):
+    struct_type = type(struct)
+    keys = frozenset(struct)
+    allowed = keys.union(STRUCTURE_KEYWORDS)
+    length = len(struct) - 1 if '_id' in struct else len(struct)
+    fields = []
+    for key in struct:
+        if not isinstance(key, basestring) or \
+           key.split('.')[-1].startswith('$'):
+            return None
+        field_path = '.'.join([path, key]).strip('.')
+        value = struct[key]
+        if type(value) is type:
+            fields.append((key, field_path, value, None))
+        else:
+            field_check = _compile_structure(value, field_path)
+            if field_check is None:
+                return None
+            fields.append((key, field_path, None, field_check))
+
+    def check(doc, value):
+        if not isinstance(value, struct_type):
+            doc._raise_exception(
+                SchemaTypeError, path,
+                "%s must be an instance of %s not %s" % (
+                    path, struct_type.__name__, type(value).__name__))
+        if len(value) != length:
+            if keys.difference(value):
+                if not doc.use_schemaless:
+                    missed = list(set(struct).difference(set(value)))
+                    for field in missed:
+                        doc._raise_exception(
+                            StructureError, None,
+                            "missed fields %s in %s" % (
+                                missed, type(value).__name__))
+            elif not allowed.issuperset(value):
+                unknown = list(set(value).difference(set(struct)))
+                bad_fields = [s for s in unknown
+                              if s not in STRUCTURE_KEYWORDS]
+                if bad_fields and not doc.use_schemaless:
+                    doc._raise_exception(
+                        StructureError, None,
+                        "unknown fields %s in %s" % (
+                            bad_fields, type(value).__name__))
+        for key, field_path, field_type, field_check in fields:
+            if key in value:
+                field = value[key]
+                if field_check is not None:
+                    field_check(doc, field)
+                elif not isinstance(field, field_type) and \
+                        field is not None:
+                    doc._raise_exception(
+                        SchemaTypeError, field_path,
+                        "%s must be an instance of %s not %s" % (
+                            field_path, field_type.__name__,
+                            type(field).__name__))
+    return check
+
+
+def _compile_list(struct, path):
+    item_check = _compile_structure(struct[0] if struct else None, path)
+    if item_check is None:
+        return None
+
+    def check(doc, value):
+        if not isinstance(value, list) and not isinstance(value, tuple):
+            doc._raise_exception(
+                SchemaTypeError, path,
+                "%s must be an instance of list not %s" % (
+                    path, type(value).__name__))
+        for item in value:
+            item_check(doc, item)
+    return check
+
+
+def _compile_required(structure, required_fields):
+    """Return the ``required_fields`` as a list of the field name, the keys
+    of its path and its structure or ``None`` if one of them is not a plain
+    field below dicts.
+    """
+    required = []
+    for field in required_fields:
+        struct = structure
+        keys = field.split('.')
+        for key in keys:
+            if type(struct) is not dict or key not in struct:
+                return None
+            struct = struct[key]
+        if isinstance(struct, (dict, CustomType)):
+            return None
+        required.append((field, keys, struct))
+    return required
+
+
+def _validation_plan(document, doc, struct):
+    """The plan of the registered class of ``document`` if ``doc`` and
+    ``struct`` are the document and its structure and not a part of them.
+    """
+    # type(document) avoids the __getattribute__ of mongokit.Document
+    if doc is not document or struct is not type(document).structure:
+        return None
+    return _validation_plans.get(_document_class(document))
+
+
+#: values which are shared instead of copied like by deepcopy
+_IMMUTABLE_TYPES = (type(None), bool, int, long, float, basestring, datetime,
+                    date, bson.ObjectId)
+
+
+def _default_factory(value):
+    """Return a function which creates the value of a default like
+    ``SchemaDocument._set_default_fields`` or ``None`` if ``value`` is used
+    as it is. Dicts and lists of immutable values are copied without
+    deepcopy.
+    """
+    if callable(value):
+        return value
+    if isinstance(value, dict):
+        copy = _plain_copy(value)
+        if copy is None:
+            return lambda: deepcopy(value)
+        return copy
+    if isinstance(value, list):
+        return lambda: value[:]
+    return None
+
+
+def _plain_copy(value):
+    """Return a function which copies ``value`` like deepcopy if it only
+    contains dicts, lists and immutable values or ``None`` otherwise.
+    """
+    if type(value) is dict:
+        items = value.items()
+    elif type(value) is list:
+        items = list(enumerate(value))
+    else:
+        return None
+    copies = []
+    for key, item in items:
+        if isinstance(item, _IMMUTABLE_TYPES):
+            continue
+        copy = _plain_copy(item)
+        if copy is None:
+            return None
+        copies.append((key, copy))
+    if not copies:
+        return value.copy if type(value) is dict else lambda: value[:]
+
+    def plain_copy():
+        result = value.copy() if type(value) is dict else value[:]
+        for key, copy in copies:
+            result[key] = copy()
+        return result
+    return plain_copy
+
+
+def _compile_defaults(structure, default_values, parents=()):
+    """Return the ``default_values`` which ``_set_default_fields`` would
+    apply as a flat list of the keys of the parent dict, the key, if the
+    values are appended to a list, the value and its factory. Returns
+    ``None`` for a structure the plan doesn't know.
+    """
+    defaults = []
+    path = '.'.join(parents)
+    for key in structure:
+        field_path = '.'.join([path, key]).strip('.')
+        struct = structure[key]
+        if isinstance(struct, dict) and struct:
+            nested = _compile_defaults(struct, default_values,
+                                       parents + (key,))
+            if nested is None:
+                return None
+            defaults.extend(nested)
+        elif field_path not in default_values:
+            continue
+        elif isinstance(struct, list):
+            if not struct:
+                return None
+            for value in default_values[field_path]:
+                defaults.append((parents, key, True, value,
+                                 _default_factory(value)))
+        else:
+            value = default_values[field_path]
+            defaults.append((parents, key, False, value,
+                             _default_factory(value)))
+    return defaults
+
+
+def _checks_validation():
+    ctx = ctx_stack.top
+    return ctx is not None and \
+        ctx.app.config.get('MONGODB_VALIDATION_CHECK', False)
+
+
+def _validation_outcome(doc, func, *args):
+    """Run ``func`` and return the raised error or the collected
+    validation errors as comparable tuples.
+    """
+    errors = dict((field, list(found)) for field, found
+                  in doc.validation_errors.items())
+    doc.validation_errors = errors
+    try:
+        func(*args)
+    except Exception as e:
+        return e, (type(e), unicode(e))
+    return None, sorted((field, [(type(e), unicode(e)) for e in found])
+                        for field, found in errors.items())
+
+
+class Document(Document):
+    #: Enables a cache in front of :meth:`get_from_id` which is shared
+    #: between requests. It's a :class:`dict` with the seconds an entry
+    #: lives as ``ttl``, the ``max_entries`` of the default
+    #: :class:`LRUCache` or another :class:`CacheBackend` as ``backend``.
+    #: Saving or deleting a document of the class drops its entry.
+    __cache__ = None
+
+    #: The name of the connection of ``MONGODB_BINDS`` which stores the
+    #: documents of this class or ``None`` for the default one.
+    __bind__ = None
+
+    #: The read preference of the queries of this class like
+    #: ``'secondaryPreferred'`` or ``None`` for the one of the connection.
+    #: See :meth:`MongoKit.read_preference` to override it.
+    __read_preference__ = None
+
+    #: The fields of a partial document loaded with ``fields``
+    _loaded_fields = None
+
+    def _compare_validation(self, name, original, compiled):
+        errors = self.validation_errors
+        expected = _validation_outcome(self, original)[1]
+        self.validation_errors = errors
+        error, outcome = _validation_outcome(self, compiled)
+        if outcome != expected:
+            raise ValidationMismatchError(
+                '%s of %s by the compiled validation: %r instead of %r' % (
+                    name, _document_class(self).__name__, outcome,
+                    expected))
+        if error is not None:
+            raise error
+
+    def _validate_doc(self, doc, struct, path=""):
+        plan = _validation_plan(self, doc, struct)
+        if plan is None or plan.check is None or path:
+            return super(Document, self)._validate_doc(doc, struct, path)
+        if _checks_validation():
+            original = super(Document, self)._validate_doc
+            return self._compare_validation(
+                '_validate_doc', lambda: original(doc, struct),
+                lambda: plan.check(self, doc))
+        plan.check(self, doc)
+
+    def _validate_required(self, doc, struct, path="", root_path=""):
+        plan = _validation_plan(self, doc, struct)
+        if plan is None or plan.required is None or path:
+            return super(Document, self)._validate_required(
+                doc, struct, path, root_path)
+        if _checks_validation():
+            original = super(Document, self)._validate_required
+            return self._compare_validation(
+                '_validate_required', lambda: original(doc, struct),
+                lambda: self._check_required(plan.required))
+        self._check_required(plan.required)
+
+    def _check_required(self, required):
+        for field, keys, struct in required:
+            value = self
+            for key in keys:
+                if not isinstance(value, dict):
+                    value = None
+                    break
+                value = value.get(key)
+            if value is None and struct is not dict:
+                self._raise_exception(RequireFieldError, field,
+                                      "%s is required" % field)
+            elif value == [] or value == {}:
+                self._raise_exception(RequireFieldError, field,
+                                      "%s is required" % field)
+
+    def _set_default_fields(self, doc, struct, path=""):
+        plan = _validation_plan(self, doc, struct)
+        if plan is None or plan.defaults is None or path:
+            return super(Document, self)._set_default_fields(doc, struct,
+                                                             path)
+        for parents, key, append, value, factory in plan.defaults:
+            target = doc
+            for parent in parents:
+                target = target[parent]
+            if factory is not None:
+                value = factory()
+            if append:
+                target[key].append(value)
+            else:
+                target[key] = value
+
+    def _process_custom_type(self, target, doc, struct, path="",
+                             root_path=""):
+        plan = _validation_plan(self, doc, struct)
+        if plan is None or plan.custom_types or path:
+            return super(Document, self)._process_custom_type(
+                target, doc, struct, path, root_path)
+
+    def get_from_id(self, id):
+        """Get one document over the _id field. If the identity map is
+        enabled with ``MONGODB_IDENTITY_MAP`` a document which was already
+        loaded in this context is returned without a query. Also the
+        cache of ``__cache__`` is asked before the server.
 
-        @app.route('/<ObjectId:task_id>')
-        def show_task(task_id):
-            task = db.Task.get_from_id(task_id)
-            return render_template('task.html', task=task)
+        :param id: The id from the document.
+        """
+        identity_map = _identity_map()
+        if identity_map is None:
+            return self._get_from_cache(id)
 
-    It checks the validate of the id and converts it into a
-    :class:`bson.objectid.ObjectId` object. The converter will be
-    automatically registered by the initialization of
-    :class:`~flask.ext.mongokit.MongoKit` with keyword :attr:`ObjectId`.
-    """
+        key = _identity_key(self, id)
+        doc = identity_map.get(key)
+        if doc is None:
+            doc = self._get_from_cache(id)
+            if doc is not None:
+                identity_map[key] = doc
+        return doc
 
-    def to_python(self, value):
-        try:
-            return bson.ObjectId(value)
-        except bson.errors.InvalidId:
-            raise abort(400)
+    def _get_from_cache(self, id):
+        doc_class = _document_class(self)
+        cache = _cache_backend(doc_class)
+        if cache is None:
+            return super(Document, self).get_from_id(id)
 
-    def to_url(self, value):
-        return str(value)
+        key = _cache_key(self.collection, id)
+        data = cache.get(key)
+        if data is not None:
+            cache._count('hits')
+            son = bson.BSON(data).decode(
+                tz_aware=self.collection.database.connection.tz_aware
+            )
+        else:
+            cache._count('misses')
+            son = self.collection.find_one({'_id': id},
+                                           **self._read_options())
+            if son is None:
+                return None
+            cache.set(key, bson.BSON.encode(son),
+                      doc_class.__cache__.get('ttl'))
+        return doc_class(son, collection=self.collection)
 
+    def get_cache(self):
+        """Return the :class:`CacheBackend` of the document class or
+        ``None`` if ``__cache__`` isn't set.
+        """
+        return _cache_backend(_document_class(self))
 
-class Document(Document):
-    def get_or_404(self, id):
+    def find(self, *args, **kwargs):
+        """Query the collection like :meth:`mongokit.Document.find`. With
+        ``raw=True`` the cursor returns the plain :class:`dict` of the
+        driver instead of documents, which is much cheaper if they are only
+        serialized again like by :func:`stream_json`.
+        """
+        if kwargs.pop('raw', False):
+            for key, value in self._read_options().items():
+                kwargs.setdefault(key, value)
+            return self.collection.find(*args, **kwargs)
+        return super(Document, self).find(*args, **kwargs)
+
+    def get_or_404(self, id, fields=None, raw=False):
         """This method get one document over the _id field. If there no
         document with this id then it will raised a 404 error.
 
         :param id: The id from the document. The most time there will be
                    an :class:`bson.objectid.ObjectId`.
+        :param fields: Load only these fields like the parameter of
+                       :meth:`find`. The result is a read-only partial
+                       document which raises :exc:`PartialDocumentError` on
+                       :meth:`save`.
+        :param raw: Return the plain :class:`dict` of the server without
+                    asking the identity map or the cache.
         """
-        doc = self.get_from_id(id)
+        if raw:
+            doc = self.collection.find_one({'_id': id}, fields,
+                                           **self._read_options())
+        elif fields is None:
+            doc = self.get_from_id(id)
+        else:
+            doc = self._find_partial({'_id': id}, fields)
         if doc is None:
             abort(404)
         else:
             return doc
 
+    def _read_options(self):
+        # the queries which don't go through the wrapping find of MongoKit
+        # have to pass the read preference of the class themselves
+        read_preference = _read_preference(_document_class(self))
+        if read_preference is None:
+            return {}
+        return {'read_preference': read_preference}
+
+    def _find_partial(self, spec, fields, *args, **kwargs):
+        for key, value in self._read_options().items():
+            kwargs.setdefault(key, value)
+        son = self.collection.find_one(spec, fields, *args, **kwargs)
+        if son is None:
+            return None
+
+        doc_class = _document_class(self)
+        doc = doc_class.__new__(doc_class)
+        # the structure of the instance only covers the loaded fields, so
+        # the missing ones are neither processed nor validated
+        structure = dict((key, value) for key, value
+                         in doc_class.structure.items() if key in son)
+        dict.__setattr__(doc, 'structure', structure)
+        dict.__setattr__(doc, '_loaded_fields', list(son))
+        doc.__init__(son, collection=self.collection)
+        return doc
+
+    def get_many(self, ids, chunk_size=1000):
+        """Get the documents of a list of ids with one ``$in`` query instead
+        of one :meth:`get_from_id` per id. The documents are returned in the
+        order of ``ids`` and ``None`` takes the place of a missing one.
+        Documents of the identity map are used and new ones are put into it.
+
+        :param ids: A list of ids.
+        :param chunk_size: The maximum number of ids per query.
+        """
+        ids = list(ids)
+        identity_map = _identity_map()
+
+        docs = {}
+        missing = []
+        for id in ids:
+            if id in docs:
+                continue
+            doc = None
+            if identity_map is not None:
+                doc = identity_map.get(_identity_key(self, id))
+            docs[id] = doc
+            if doc is None:
+                missing.append(id)
+
+        for i in range(0, len(missing), chunk_size):
+            query = {'_id': {'$in': missing[i:i + chunk_size]}}
+            for doc in self.find(query):
+                if identity_map is not None:
+                    doc = identity_map.setdefault(
+                        _identity_key(self, doc['_id']), doc
+                    )
+                docs[doc['_id']] = doc
+
+        return [docs[id] for id in ids]
+
+    def get_many_or_404(self, ids, chunk_size=1000):
+        """Like :meth:`get_many` but if one of the documents doesn't exist
+        then it will raise a 404 error.
+
+        :param ids: A list of ids.
+        :param chunk_size: The maximum number of ids per query.
+        """
+        docs = self.get_many(ids, chunk_size)
+        for doc in docs:
+            if doc is None:
+                abort(404)
+        return docs
+
     def find_one_or_404(self, *args, **kwargs):
         """This method get one document over normal query parameter like
         :meth:`~flask.ext.mongokit.Document.find_one` but if there no document
-        then it will raise a 404 error.
+        then it will raise a 404 error. If ``fields`` is given the result
+        is a read-only partial document like of :meth:`get_or_404`. With
+        ``raw=True`` it's the plain :class:`dict` of the server.
         """
+        raw = kwargs.pop('raw', False)
+        fields = kwargs.pop('fields', None)
+        if fields is None and len(args) > 1:
+            fields = args[1]
+            args = args[:1] + args[2:]
+
+        id = _id_from_query(args, kwargs)
+        if id is not _no_id:
+            return self.get_or_404(id, fields, raw)
 
-        doc = self.find_one(*args, **kwargs)
+        if raw:
+            for key, value in self._read_options().items():
+                kwargs.setdefault(key, value)
+            doc = self.collection.find_one(args and args[0] or None, fields,
+                                           *args[1:], **kwargs)
+            if doc is None:
+                abort(404)
+            return doc
+        if fields is None:
+            doc = self.find_one(*args, **kwargs)
+        else:
+            doc = self._find_partial(args and args[0] or None, fields,
+                                     *args[1:], **kwargs)
         if doc is None:
             abort(404)
-        else:
+        if fields is not None:
             return doc
 
+        identity_map = _identity_map()
+        if identity_map is not None and '_id' in doc:
+            # keep the instance which was loaded first in this context
+            doc = identity_map.setdefault(_identity_key(self, doc['_id']),
+                                          doc)
+        return doc
+
+    def paginate(self, query=None, per_page=20, after=None, sort_key='_id',
+                 direction=ASCENDING):
+        """Return a :class:`Page` of the documents which match ``query``.
+        The pages are built with the range of ``sort_key`` and ``_id``
+        instead of :meth:`~pymongo.cursor.Cursor.skip`, so every page costs
+        the same no matter how deep it is. ``sort_key`` should be indexed
+        together with ``_id``.
+
+        .. code-block:: python
+
+            @app.route('/')
+            def show_all():
+                tasks = db.Task.paginate(after=request.args.get('after'))
+                return render_template('list.html', tasks=tasks)
+
+        :param query: The query like for :meth:`find`.
+        :param per_page: The number of documents per page. It's limited by
+                         ``MONGODB_MAX_PER_PAGE``.
+        :param after: The :attr:`~Page.next_token` of the previous page or
+                      ``None`` for the first page.
+        :param sort_key: The field the documents are sorted by. Documents
+                         without it are sorted before the others. Besides
+                         ``null`` its values should be of one type, because
+                         MongoDB compares only values of the same type.
+        :param direction: :data:`~pymongo.ASCENDING` or
+                          :data:`~pymongo.DESCENDING`.
+        """
+        max_per_page = ctx_stack.top.app.config.get('MONGODB_MAX_PER_PAGE')
+        if max_per_page:
+            per_page = min(per_page, max_per_page)
+
+        spec = query or {}
+        if after is not None:
+            value, id = _decode_page_token(after)
+            keyset = _keyset(sort_key, value, id, direction)
+            if spec:
+                spec = {'$and': [spec, keyset]}
+            else:
+                spec = keyset
+
+        sort = [(sort_key, direction)]
+        if sort_key != '_id':
+            sort.append(('_id', direction))
+
+        items = list(self.find(spec).sort(sort).limit(per_page + 1))
+        has_next = len(items) > per_page
+        next_token = None
+        if has_next:
+            items = items[:per_page]
+            last = items[-1]
+            next_token = _encode_page_token(_get_path(last, sort_key),
+                                            last['_id'])
+        return Page(items, has_next, next_token)
+
+    def paginate_or_404(self, query=None, per_page=20, after=None,
+                        sort_key='_id', direction=ASCENDING):
+        """Like :meth:`paginate` but it will raise a 404 error if the page
+        token is invalid or a page after the first one is empty.
+        """
+        try:
+            page = self.paginate(query, per_page, after, sort_key, direction)
+        except ValueError:
+            abort(404)
+        if not page.items and after is not None:
+            abort(404)
+        return page
+
+    def save(self, *args, **kwargs):
+        """Save the document like :meth:`mongokit.Document.save`, put it
+        into the identity map of the current context and drop it from the
+        cache of ``__cache__``.
+        """
+        self._check_partial()
+        super(Document, self).save(*args, **kwargs)
+        self._saved()
+
+    def _check_partial(self):
+        if self._loaded_fields is not None:
+            raise PartialDocumentError(
+                'The document was loaded with only the fields %s and can '
+                'not be saved' % ', '.join(self._loaded_fields)
+            )
+
+    def _saved(self):
+        cache = _cache_backend(_document_class(self))
+        if cache is not None:
+            cache.delete(_cache_key(self.collection, self['_id']))
+
+        identity_map = _identity_map()
+        if identity_map is not None:
+            # the instances of other classes are outdated now
+            _forget_identity(identity_map, self.collection.full_name,
+                             self['_id'])
+            identity_map[_identity_key(self, self['_id'])] = self
+
+    def delete(self):
+        """Delete the document like :meth:`mongokit.Document.delete` and
+        remove it from the identity map and the cache of ``__cache__``.
+        """
+        super(Document, self).delete()
+
+        cache = _cache_backend(_document_class(self))
+        if cache is not None:
+            cache.delete(_cache_key(self.collection, self['_id']))
+
+        identity_map = _identity_map()
+        if identity_map is not None:
+            _forget_identity(identity_map, self.collection.full_name,
+                             self['_id'])
+
+    def bulk_save(self, docs, ordered=False, batch_size=1000, validate=None,
+                  threads=None):
+        """Save many documents with a few bulk writes instead of one
+        :meth:`save` round-trip per document. All documents are validated
+        first, then documents without an ``_id`` are inserted and the others
+        replaced or upserted, ``batch_size`` documents per bulk write.
+
+        .. code-block:: python
+
+            tasks = [db.Task(row) for row in rows]
+            errors = db.Task.bulk_save(tasks)
+
+        A failing document doesn't stop the others. The method returns a list
+        with the exception of each document or ``None`` if it was saved. If
+        only the write concern of a batch failed, its documents were written
+        but get the :exc:`~pymongo.errors.OperationFailure` of the write
+        concern as error. If a whole batch fails, for example with
+        :exc:`~pymongo.errors.AutoReconnect`, each of its documents gets that
+        exception and may or may not be written.
+
+        :param docs: A list of documents.
+        :param ordered: Write the documents in order and stop at the first
+                        failed write. The remaining documents get an
+                        :exc:`~pymongo.errors.OperationFailure` as error.
+        :param batch_size: The maximum number of documents per bulk write.
+        :param validate: Like the parameter of :meth:`save`.
+        :param threads: Validate the documents in a pool of this many threads.
+        """
+        docs = list(docs)
+        errors = [None] * len(docs)
+
+        def validate_doc(index):
+            doc = docs[index]
+            try:
+                doc._check_partial()
+                if validate is True or \
+                   (validate is None and doc.skip_validation is False):
+                    doc.validate(auto_migrate=False)
+                elif doc.use_autorefs:
+                    doc._make_reference(doc, doc.structure)
+            except Exception as e:
+                errors[index] = e
+
+        if threads:
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(validate_doc, range(len(docs))))
+        else:
+            for index in range(len(docs)):
+                validate_doc(index)
+
+        valid = [index for index in range(len(docs)) if errors[index] is None]
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            if ordered:
+                bulk = self.collection.initialize_ordered_bulk_op()
+            else:
+                bulk = self.collection.initialize_unordered_bulk_op()
+
+            converted = []
+            write_errors = []
+            unconfirmed = []
+            batch_failed = False
+            try:
+                for index in batch:
+                    doc = docs[index]
+                    doc._process_custom_type('bson', doc, doc.structure)
+                    converted.append(doc)
+                    if '_id' in doc:
+                        spec = {'_id': doc['_id']}
+                        bulk.find(spec).upsert().replace_one(doc)
+                    else:
+                        doc['_id'] = bson.ObjectId()
+                        bulk.insert(doc)
+
+                _trace(self.collection, 'bulk_write', None, bulk.execute)
+            except BulkWriteError as e:
+                write_errors = e.details.get('writeErrors') or []
+                for error in write_errors:
+                    errors[batch[error['index']]] = OperationFailure(
+                        error['errmsg'], error['code']
+                    )
+                if ordered and write_errors:
+                    failed = write_errors[0]['index']
+                    skipped = batch[failed + 1:] + valid[start + batch_size:]
+                    for index in skipped:
+                        errors[index] = OperationFailure(
+                            'Not saved because of an earlier error'
+                        )
+                concern_errors = e.details.get('writeConcernErrors')
+                if concern_errors:
+                    # the documents were written but not confirmed
+                    error = concern_errors[0]
+                    for index in batch:
+                        if errors[index] is None:
+                            unconfirmed.append(index)
+                            errors[index] = OperationFailure(
+                                error['errmsg'], error.get('code')
+                            )
+            except (OperationFailure, AutoReconnect) as e:
+                # the documents of the batch may be written or not
+                batch_failed = True
+                for index in batch:
+                    errors[index] = e
+            finally:
+                for doc in converted:
+                    doc._process_custom_type('python', doc, doc.structure)
+
+            for index in batch:
+                if errors[index] is None or index in unconfirmed:
+                    docs[index]._saved()
+
+            if ordered and batch_failed:
+                for index in valid[start + batch_size:]:
+                    errors[index] = OperationFailure(
+                        'Not saved because of an earlier error'
+                    )
+            if ordered and (write_errors or batch_failed):
+                break
+
+        return errors
+
+
+def _json_default(value):
+    if isinstance(value, bson.ObjectId):
+        # like BSONObjectIdConverter.to_url
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _encode_json(doc):
+    return json.dumps(doc, default=_json_default, separators=(',', ':'))
+
+
+def stream_json(cursor, ndjson=False, batch_size=None):
+    """Return a :class:`~flask.Response` which streams the documents of
+    ``cursor`` as JSON array or as newline delimited JSON. The documents are
+    fetched and sent ``batch_size`` at a time, so the first bytes are sent
+    at once and the memory doesn't grow with the number of documents.
+    :class:`~bson.objectid.ObjectId` is encoded like in the URLs of
+    :class:`BSONObjectIdConverter` and dates in ISO 8601.
+
+    .. code-block:: python
+
+        @app.route('/export')
+        def export():
+            return stream_json(db.Task.find(), ndjson=True)
+
+    :param cursor: A cursor of :meth:`~Document.find` or any other iterable
+                   of documents.
+    :param ndjson: Send one document per line instead of a JSON array.
+    :param batch_size: The number of documents per batch. Default is
+                       ``MONGODB_STREAM_BATCH_SIZE``.
+    """
+    app = ctx_stack.top.app
+    if batch_size is None:
+        batch_size = app.config.get('MONGODB_STREAM_BATCH_SIZE')
+    if isinstance(cursor, PymongoCursor):
+        cursor.batch_size(batch_size)
+
+    def join(batch, first):
+        if ndjson:
+            return '\n'.join(batch) + '\n'
+        if first:
+            return ','.join(batch)
+        return ',' + ','.join(batch)
+
+    def generate():
+        if not ndjson:
+            yield '['
+        first = True
+        batch = []
+        for doc in cursor:
+            batch.append(_encode_json(doc))
+            if len(batch) >= batch_size:
+                yield join(batch, first)
+                first = False
+                batch = []
+        if batch:
+            yield join(batch, first)
+        if not ndjson:
+            yield ']'
+
+    if ndjson:
+        mimetype = 'application/x-ndjson'
+    else:
+        mimetype = 'application/json'
+    body = generate()
+    if stream_with_context is not None:
+        # the request and g are available until the last document is sent
+        body = stream_with_context(body)
+    return app.response_class(body, mimetype=mimetype)
+
+
+def _new_context(app):
+    if hasattr(app, 'app_context'):
+        return app.app_context()
+    # Flask before 0.9
+    return app.test_request_context() # pragma: no cover
+
+
+def _borrow_connection(source, target):
+    """Let the context ``target`` of another thread use the connection of
+    the context ``source``.
+    """
+    target.mongokit_connection = source.mongokit_connection
+    target.mongokit_database = source.mongokit_database
+    target.mongokit_shared = source.mongokit_shared
+    target.mongokit_attributes = {}
+    target.mongokit_items = {}
+    target.mongokit_identity_map = source.mongokit_identity_map
+    target.mongokit_binds = source.mongokit_binds
+    target.mongokit_recorder = source.mongokit_recorder
+    target.mongokit_queries = source.mongokit_queries
+    target.mongokit_query_shapes = source.mongokit_query_shapes
+    target.mongokit_plan_problems = source.mongokit_plan_problems
+    target.mongokit_read_preference = getattr(
+        source, 'mongokit_read_preference', None
+    )
+    target.mongokit_borrowed = True
+
+
+def _call_and_fetch(func, *args, **kwargs):
+    result = func(*args, **kwargs)
+    if isinstance(result, PymongoCursor):
+        # fetch the documents inside of the thread pool
+        result = list(result)
+    return result
+
+
+class Future(object):
+    """The pending result of :meth:`MongoKit.submit` and
+    :class:`AsyncMongoKit`. Wait for it with :meth:`result`.
+    """
+
+    def __init__(self, future):
+        self._future = future
+
+    def result(self, timeout=None):
+        """Wait for the result and return it or raise its exception."""
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        """Wait for the result and return its exception or ``None``."""
+        return self._future.exception(timeout)
+
+    def done(self):
+        """``True`` if the result is available."""
+        return self._future.done()
+
+
+class _AsyncProxy(object):
+
+    def __init__(self, mongokit, target):
+        self._mongokit = mongokit
+        self._target = target
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+
+        def submit(*args, **kwargs):
+            return self._mongokit.submit(_call_and_fetch, value,
+                                         *args, **kwargs)
+        return submit
+
+    def __call__(self, *args, **kwargs):
+        # a method of the database like db.aio.collection_names()
+        return self._mongokit.submit(_call_and_fetch, self._target,
+                                     *args, **kwargs)
+
+
+class AsyncMongoKit(object):
+    """Variant of a :class:`MongoKit` instance which is available as
+    :attr:`MongoKit.aio`. It uses the same registered documents,
+    configuration and connection, but every operation runs in the thread
+    pool of the extension and returns a :class:`Future` instead of blocking.
+    A cursor of ``find`` is fetched inside of the pool to a list. Methods of
+    the database like ``db.aio.collection_names()`` run there too. The view
+    can do other work until it waits for the result:
+
+    .. code-block:: python
+
+        @app.route('/<ObjectId:task_id>')
+        def show_task(task_id):
+            task = db.aio.Task.get_or_404(task_id)
+            comments = list(db.Comment.find({'task': task_id}))
+            return render_template('task.html', task=task.result(),
+                                   comments=comments)
+    """
+
+    def __init__(self, mongokit):
+        self._mongokit = mongokit
+
+    def __getattr__(self, name):
+        return _AsyncProxy(self._mongokit, getattr(self._mongokit, name))
+
+    def __getitem__(self, name):
+        return _AsyncProxy(self._mongokit, self._mongokit[name])
+
+    def save(self, doc, *args, **kwargs):
+        """Save ``doc`` like :meth:`Document.save`."""
+        return self._mongokit.submit(doc.save, *args, **kwargs)
+
+    def delete(self, doc):
+        """Delete ``doc`` like :meth:`Document.delete`."""
+        return self._mongokit.submit(doc.delete)
+
 
 class MongoKit(object):
     """This class is used to integrate `MongoKit`_ into a Flask application.
@@ -96,6 +2057,19 @@ class MongoKit(object):
         #: which will be automated registed at connection
         self.registered_documents = []
 
+        # the bind of every registered document by its name
+        self._document_binds = {}
+        self._shared_connections = {}
+        # the applications whose indexes were ensured by this process
+        self._indexed_apps = set()
+        # the problem of the plan of every explained query shape or None
+        self._query_plans = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._executor = None
+        #: The :class:`Metrics` of all applications of this instance
+        self.metrics = Metrics(self)
+
         if app is not None:
             self.app = app
             self.init_app(self.app)
@@ -118,8 +2092,33 @@ class MongoKit(object):
         app.config.setdefault('MONGODB_PORT', 27017)
         app.config.setdefault('MONGODB_DATABASE', 'flask')
         app.config.setdefault('MONGODB_SLAVE_OKAY', False)
+        app.config.setdefault('MONGODB_REPLICA_SET', None)
+        app.config.setdefault('MONGODB_READ_PREFERENCE', None)
+        app.config.setdefault('MONGODB_BINDS', {})
+        app.config.setdefault('MONGODB_ENSURE_INDEXES', False)
         app.config.setdefault('MONGODB_USERNAME', None)
         app.config.setdefault('MONGODB_PASSWORD', None)
+        app.config.setdefault('MONGODB_LAZY_CONNECT', False)
+        app.config.setdefault('MONGODB_IDENTITY_MAP', False)
+        app.config.setdefault('MONGODB_MAX_PER_PAGE', 100)
+        app.config.setdefault('MONGODB_EXECUTOR_WORKERS', 4)
+        app.config.setdefault('MONGODB_STREAM_BATCH_SIZE', 1000)
+        app.config.setdefault('MONGODB_POOL', False)
+        app.config.setdefault('MONGODB_POOL_SIZE', 10)
+        app.config.setdefault('MONGODB_POOL_IDLE_TIMEOUT', None)
+        app.config.setdefault('MONGODB_POOL_MAX_LIFETIME', None)
+        app.config.setdefault('MONGODB_POOL_WARMUP', 0)
+        app.config.setdefault('MONGODB_RECORD_QUERIES', False)
+        app.config.setdefault('MONGODB_SLOW_QUERY_MS', None)
+        app.config.setdefault('MONGODB_DETECT_N_PLUS_ONE', None)
+        app.config.setdefault('MONGODB_N_PLUS_ONE_LIMIT', 10)
+        app.config.setdefault('MONGODB_N_PLUS_ONE_ACTION', 'warn')
+        app.config.setdefault('MONGODB_EXPLAIN_QUERIES', False)
+        app.config.setdefault('MONGODB_EXPLAIN_MAX_RATIO', 10)
+        app.config.setdefault('MONGODB_EXPLAIN_ACTION', 'warn')
+        app.config.setdefault('MONGODB_METRICS', False)
+        app.config.setdefault('MONGODB_METRICS_URL', None)
+        app.config.setdefault('MONGODB_VALIDATION_CHECK', False)
 
         # 0.9 and later
         # no coverage check because there is everytime only one
@@ -137,6 +2136,15 @@ class MongoKit(object):
         app.extensions['mongokit'] = self
 
         app.url_map.converters['ObjectId'] = BSONObjectIdConverter
+        app.url_map.converters['ObjectIds'] = BSONObjectIdListConverter
+
+        if app.config.get('MONGODB_METRICS_URL'):
+            app.add_url_rule(app.config.get('MONGODB_METRICS_URL'),
+                             'mongokit_metrics', self._metrics_view)
+
+        # Flask 0.11 and later
+        if hasattr(app, 'cli'): # pragma: no cover
+            self._register_commands(app)
 
         self.app = app
 
@@ -173,6 +2181,10 @@ class MongoKit(object):
         for document in documents:
             if document not in self.registered_documents:
                 self.registered_documents.append(document)
+            if issubclass(document, Document):
+                _validation_plans[document] = _ValidationPlan(document)
+            self._document_binds[document.__name__] = \
+                getattr(document, '__bind__', None)
 
         if decorator is None:
             return self.registered_documents
@@ -185,6 +2197,14 @@ class MongoKit(object):
         ``MONGODB_PASSWORD`` then you will be authenticated at the
         ``MONGODB_DATABASE``. You can also enable timezone awareness if
         you set to True ``MONGODB_TZ_AWARE`.
+
+        If ``MONGODB_POOL`` is enabled all contexts of an application share
+        one long-lived connection per process instead of opening their own.
+        The authentication is then only done once per shared connection.
+
+        With ``MONGODB_LAZY_CONNECT`` this method returns immediately. The
+        connection is opened and authenticated by the first operation which
+        really has to talk to the server.
         """
         if self.app is None:
             raise RuntimeError('The flask-mongokit extension was not init to '
@@ -194,14 +2214,13 @@ class MongoKit(object):
         ctx = ctx_stack.top
         mongokit_connection = getattr(ctx, 'mongokit_connection', None)
         if mongokit_connection is None:
-            ctx.mongokit_connection = Connection(
-                host=ctx.app.config.get('MONGODB_HOST'),
-                port=ctx.app.config.get('MONGODB_PORT'),
-                slave_okay=ctx.app.config.get('MONGODB_SLAVE_OKAY'),
-                tz_aware=ctx.app.config.get('MONGODB_TZ_AWARE', False)
-            )
-
-            ctx.mongokit_connection.register(self.registered_documents)
+            if ctx.app.config.get('MONGODB_POOL'):
+                ctx.mongokit_shared = self._checkout(ctx.app)
+                ctx.mongokit_connection = ctx.mongokit_shared.connection
+            else:
+                ctx.mongokit_shared = None
+                ctx.mongokit_connection = self._create_connection(ctx.app)
+                ctx.mongokit_connection.register(self.registered_documents)
 
         mongokit_database = getattr(ctx, 'mongokit_database', None)
         if mongokit_database is None:
@@ -209,18 +2228,525 @@ class MongoKit(object):
                 ctx.mongokit_connection,
                 ctx.app.config.get('MONGODB_DATABASE')
             )
+            # resolved collections and documents of this context
+            ctx.mongokit_attributes = {}
+            ctx.mongokit_items = {}
+            # databases and shared connections of the used binds
+            ctx.mongokit_binds = {}
+            if ctx.app.config.get('MONGODB_IDENTITY_MAP'):
+                ctx.mongokit_identity_map = {}
+            else:
+                ctx.mongokit_identity_map = None
+            if ctx.app.config.get('MONGODB_RECORD_QUERIES'):
+                ctx.mongokit_queries = []
+            else:
+                ctx.mongokit_queries = None
+            if self._detects_n_plus_one(ctx.app):
+                # number of queries per collection, operation and shape
+                ctx.mongokit_query_shapes = {}
+            else:
+                ctx.mongokit_query_shapes = None
+            if ctx.app.config.get('MONGODB_EXPLAIN_QUERIES'):
+                # queries with a bad plan and the reason
+                ctx.mongokit_plan_problems = []
+            else:
+                ctx.mongokit_plan_problems = None
+            if self._records_queries(ctx.app):
+                ctx.mongokit_recorder = self
+            else:
+                ctx.mongokit_recorder = None
 
-        if ctx.app.config.get('MONGODB_USERNAME') is not None:
             try:
-                auth_success = ctx.mongokit_database.authenticate(
-                    ctx.app.config.get('MONGODB_USERNAME'),
-                    ctx.app.config.get('MONGODB_PASSWORD')
+                self._authenticate(ctx.mongokit_database, ctx.app.config,
+                                   ctx.mongokit_shared)
+            except AuthenticationIncorrect:
+                self.disconnect()
+                raise
+
+            if ctx.app.config.get('MONGODB_ENSURE_INDEXES'):
+                self._ensure_indexes_once(ctx.app)
+
+    def _get_config(self, app, bind=None):
+        """Return the configuration of ``bind``: the one of ``app`` updated
+        with the values of the bind in ``MONGODB_BINDS``.
+        """
+        if bind is None:
+            return app.config
+        binds = app.config.get('MONGODB_BINDS') or {}
+        if bind not in binds:
+            raise RuntimeError('The bind %r is not configured in '
+                               'MONGODB_BINDS' % bind)
+        config = dict(app.config)
+        config.update(binds[bind])
+        return config
+
+    def get_database(self, bind=None):
+        """Return the database of ``bind`` for the current context. The
+        connection of a bind is opened the first time it is used.
+
+        :param bind: The name of the bind in ``MONGODB_BINDS`` or ``None``
+                     for the database of ``MONGODB_DATABASE``.
+        """
+        if not self.connected:
+            self.connect()
+        ctx = ctx_stack.top
+        if bind is None:
+            return ctx.mongokit_database
+        try:
+            return ctx.mongokit_binds[bind][0]
+        except KeyError:
+            pass
+
+        config = self._get_config(ctx.app, bind)
+        if config.get('MONGODB_POOL'):
+            shared = self._checkout(ctx.app, bind)
+            connection = shared.connection
+        else:
+            shared = None
+            connection = self._create_connection(ctx.app, bind)
+            connection.register(self.registered_documents)
+        database = Database(connection, config.get('MONGODB_DATABASE'))
+        ctx.mongokit_binds[bind] = (database, shared)
+
+        try:
+            self._authenticate(database, config, shared)
+        except AuthenticationIncorrect:
+            del ctx.mongokit_binds[bind]
+            self._close(connection, shared)
+            raise
+        return database
+
+    def _records_queries(self, app):
+        return app.config.get('MONGODB_RECORD_QUERIES') or \
+            app.config.get('MONGODB_SLOW_QUERY_MS') is not None or \
+            app.config.get('MONGODB_METRICS') or \
+            app.config.get('MONGODB_EXPLAIN_QUERIES') or \
+            self._detects_n_plus_one(app)
+
+    def _detects_n_plus_one(self, app):
+        detect = app.config.get('MONGODB_DETECT_N_PLUS_ONE')
+        if detect is None:
+            # the debug flag can still be set by app.run()
+            return app.testing or app.debug
+        return detect
+
+    def _record_query(self, ctx, query, collection):
+        if ctx.mongokit_queries is not None:
+            ctx.mongokit_queries.append(query)
+        if ctx.app.config.get('MONGODB_METRICS'):
+            self.metrics.observe_query(query)
+
+        slow_query_ms = ctx.app.config.get('MONGODB_SLOW_QUERY_MS')
+        if slow_query_ms is not None and \
+           query.duration * 1000 >= slow_query_ms:
+            request_ctx = _request_ctx_stack.top
+            if request_ctx is not None:
+                endpoint = request_ctx.request.endpoint
+            else:
+                endpoint = None
+            ctx.app.logger.warning(
+                'Slow query in %s: %s on %s with %s took %.1fms',
+                endpoint, query.operation, query.collection, query.shape,
+                query.duration * 1000
+            )
+
+        if ctx.mongokit_query_shapes is not None and \
+           query.operation in ('find', 'find_one'):
+            self._check_n_plus_one(ctx, query)
+
+        # a query without a filter has to scan the whole collection anyway
+        if ctx.mongokit_plan_problems is not None and query.spec and \
+           query.operation in ('find', 'find_one'):
+            self._check_query_plan(ctx, query, collection)
+
+    def _check_query_plan(self, ctx, query, collection):
+        key = (query.collection, query.shape)
+        try:
+            problem = self._query_plans[key]
+        except KeyError:
+            # the cursor of pymongo isn't recorded, so the explain doesn't
+            # end up here again
+            plan = PymongoCursor(collection, query.spec).explain()
+            problem = _plan_problem(
+                plan, ctx.app.config.get('MONGODB_EXPLAIN_MAX_RATIO')
+            )
+            self._query_plans[key] = problem
+
+        if problem is None:
+            return
+        if ctx.app.config.get('MONGODB_EXPLAIN_ACTION') == 'raise':
+            # an exception of a teardown function would leave the context
+            # on the stack, so the query itself fails
+            raise QueryPlanError('%s on %s with %s: %s' % (
+                query.operation, query.collection, query.shape, problem
+            ))
+        if key not in [(other.collection, other.shape)
+                       for other, reason in ctx.mongokit_plan_problems]:
+            ctx.mongokit_plan_problems.append((query, problem))
+
+    def _report_query_plans(self, ctx):
+        problems = getattr(ctx, 'mongokit_plan_problems', None)
+        if not problems:
+            return
+        message = 'Queries without a fitting index:\n' + '\n'.join(
+            '  %s on %s with %s: %s' % (query.operation, query.collection,
+                                        query.shape, problem)
+            for query, problem in problems
+        )
+        warnings.warn(message, QueryPlanWarning)
+
+    def _record_reconnect(self, ctx):
+        if ctx.app.config.get('MONGODB_METRICS'):
+            self.metrics._increment('reconnects')
+
+    def _check_n_plus_one(self, ctx, query):
+        key = (query.collection, query.operation, query.shape)
+        count = ctx.mongokit_query_shapes.get(key, 0) + 1
+        ctx.mongokit_query_shapes[key] = count
+        # report every repeated query only once per context
+        if count != ctx.app.config.get('MONGODB_N_PLUS_ONE_LIMIT'):
+            return
+
+        message = '%d times %s on %s with %s in one context' % (
+            count, query.operation, query.collection, query.shape
+        )
+        if query.shape == '{_id: ?}':
+            message += ', load the documents with one query of ' \
+                       'Document.get_many() instead'
+        else:
+            message += ', load the documents with one $in query instead'
+        call_site = _call_site()
+        if call_site is not None:
+            message += ' (%s:%d in %s)' % call_site
+
+        if ctx.app.config.get('MONGODB_N_PLUS_ONE_ACTION') == 'raise':
+            raise NPlusOneError(message)
+        if call_site is not None:
+            warnings.warn_explicit(message, NPlusOneWarning,
+                                   call_site[0], call_site[1])
+        else:
+            warnings.warn(message, NPlusOneWarning)
+
+    def _authenticate(self, database, config, shared=None):
+        if config.get('MONGODB_USERNAME') is None or \
+           config.get('MONGODB_LAZY_CONNECT'):
+            return
+        if shared is not None and shared.authenticated:
+            return
+
+        try:
+            auth_success = database.authenticate(
+                config.get('MONGODB_USERNAME'),
+                config.get('MONGODB_PASSWORD')
+            )
+        except OperationFailure:
+            auth_success = False
+
+        if config.get('MONGODB_METRICS'):
+            self.metrics._increment('auth_handshakes')
+        if not auth_success:
+            raise AuthenticationIncorrect('Server authentication failed')
+        if shared is not None:
+            shared.authenticated = True
+
+    def _create_connection(self, app, bind=None, **kwargs):
+        config = self._get_config(app, bind)
+        host = config.get('MONGODB_HOST')
+        port = config.get('MONGODB_PORT')
+        if not isinstance(host, basestring):
+            host = _join_hosts(host, port)
+        if config.get('MONGODB_READ_PREFERENCE') is not None:
+            kwargs.setdefault('read_preference', _resolve_read_preference(
+                config.get('MONGODB_READ_PREFERENCE')
+            ))
+        if config.get('MONGODB_POOL'):
+            kwargs.setdefault('max_pool_size',
+                              config.get('MONGODB_POOL_SIZE'))
+        if config.get('MONGODB_LAZY_CONNECT'):
+            kwargs.setdefault('_connect', False)
+            if config.get('MONGODB_USERNAME') is not None:
+                # the driver authenticates lazily with the credentials of
+                # the URI when it opens a socket
+                if not host.startswith('mongodb://'):
+                    host = 'mongodb://' + _join_hosts(host, port)
+                host = _add_credentials(host,
+                                        config.get('MONGODB_USERNAME'),
+                                        config.get('MONGODB_PASSWORD'),
+                                        config.get('MONGODB_DATABASE'))
+        if config.get('MONGODB_METRICS'):
+            self.metrics._increment('connections')
+
+        if config.get('MONGODB_REPLICA_SET') or \
+           'replicaset=' in host.lower():
+            # only the replica set connection reads from secondaries
+            if not host.startswith('mongodb://'):
+                host = _join_hosts(host, port)
+            if config.get('MONGODB_REPLICA_SET'):
+                kwargs.setdefault('replicaSet',
+                                  config.get('MONGODB_REPLICA_SET'))
+            return ReplicaSetConnection(
+                host,
+                slave_okay=config.get('MONGODB_SLAVE_OKAY'),
+                tz_aware=config.get('MONGODB_TZ_AWARE', False),
+                **kwargs
+            )
+        return Connection(
+            host=host,
+            port=port,
+            slave_okay=config.get('MONGODB_SLAVE_OKAY'),
+            tz_aware=config.get('MONGODB_TZ_AWARE', False),
+            **kwargs
+        )
+
+    def _checkout(self, app, bind=None):
+        """Borrow the shared connection of ``app`` and ``bind``. A new one is
+        created if there is none yet or the old one has exceeded
+        ``MONGODB_POOL_IDLE_TIMEOUT`` or ``MONGODB_POOL_MAX_LIFETIME``.
+        """
+        self._check_pid()
+        config = self._get_config(app, bind)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            shared = self._shared_connections.get((app, bind))
+            if shared is not None and shared.expired(
+                    now, config.get('MONGODB_POOL_IDLE_TIMEOUT'),
+                    config.get('MONGODB_POOL_MAX_LIFETIME')):
+                self._retire(shared)
+                shared = None
+            if shared is None:
+                shared = _SharedConnection(
+                    self._create_connection(app, bind)
+                )
+                self._shared_connections[(app, bind)] = shared
+            if shared.registered != len(self.registered_documents):
+                shared.connection.register(self.registered_documents)
+                shared.registered = len(self.registered_documents)
+            shared.in_use += 1
+            shared.last_used = now
+        finally:
+            self._lock.release()
+
+        if config.get('MONGODB_METRICS'):
+            self.metrics._increment('checkouts')
+            self.metrics._increment('checkout_seconds', time.time() - now)
+        return shared
+
+    def _release(self, shared):
+        """Give a borrowed shared connection back. The socket of the current
+        thread is returned into the pool of the connection.
+        """
+        shared.connection.end_request()
+        self._lock.acquire()
+        try:
+            shared.in_use -= 1
+            shared.last_used = time.time()
+            if shared.retired and not shared.in_use:
+                shared.close()
+        finally:
+            self._lock.release()
+
+    def _check_pid(self):
+        """Drop all shared connections which were inherited from the parent
+        process after a fork. They will be rebuilt lazily in the child.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        # the lock could be held by a thread of the parent which doesn't
+        # exist in the child
+        self._lock = threading.Lock()
+        inherited = self._shared_connections.values()
+        self._shared_connections = {}
+        self._indexed_apps = set()
+        # the threads of the executor don't exist in the child
+        self._executor = None
+        self._pid = pid
+        for shared in inherited:
+            shared.close()
+
+    def warm_up(self, app=None, sockets=None, bind=None):
+        """Open the shared connection of ``app`` and ``sockets`` sockets of
+        its pool ahead of time, so the first requests don't have to pay for
+        the connection setup. It's intended to be called after the fork of a
+        worker process like in the ``post_fork`` hook of gunicorn:
+
+        .. code-block:: python
+
+            def post_fork(server, worker):
+                from todo import app, db
+                db.warm_up(app)
+
+        :param app: The Flask application of the shared connection. Default
+                    is the application of :meth:`init_app`.
+        :param sockets: Number of sockets to open. Default is
+                        ``MONGODB_POOL_WARMUP``.
+        :param bind: The name of the bind in ``MONGODB_BINDS`` or ``None``
+                     for the default connection.
+        """
+        if app is None:
+            app = self.app
+        config = self._get_config(app, bind)
+        if sockets is None:
+            sockets = config.get('MONGODB_POOL_WARMUP')
+        sockets = min(sockets, config.get('MONGODB_POOL_SIZE'))
+
+        shared = self._checkout(app, bind)
+        try:
+            self._authenticate(
+                shared.connection[config.get('MONGODB_DATABASE')],
+                config, shared
+            )
+            _open_sockets(shared.connection, sockets)
+        finally:
+            self._release(shared)
+
+    def ensure_indexes(self, app=None, dry_run=False, background=True):
+        """Create the ``indexes`` of the :attr:`registered_documents` which
+        don't exist on the server yet. The existing indexes are left alone,
+        so it's cheap to call it again. With ``MONGODB_ENSURE_INDEXES`` it
+        runs once per process in a background thread after the first
+        connect. With Flask 0.11 and later it's also available as command::
+
+            $ flask ensure-indexes --dry-run
+
+        An existing index with other ``unique``, ``sparse`` or
+        ``expireAfterSeconds`` options is dropped and built again.
+
+        Returns a list of the missing indexes as :class:`dict` with the name
+        of the ``document``, the ``collection``, the ``keys``, the
+        ``options``, if it was ``created`` and if an existing index was
+        ``changed``.
+
+        :param app: The Flask application of the documents. Default is the
+                    application of :meth:`init_app`.
+        :param dry_run: Only report the missing indexes.
+        :param background: Build the indexes in the background of the
+                           server without blocking the collection. The
+                           ``background`` option of an index takes
+                           precedence.
+        """
+        if app is None:
+            app = self.app
+
+        ctx = _new_context(app)
+        ctx.push()
+        try:
+            report = []
+            existing = {}
+            for document in self.registered_documents:
+                if not document.indexes or \
+                   not getattr(document, '__collection__', None):
+                    continue
+                database = self.get_database(
+                    getattr(document, '__bind__', None)
                 )
-            except OperationFailure:
-                auth_success = False
+                collection = database[document.__collection__]
+                if collection.full_name not in existing:
+                    existing[collection.full_name] = [
+                        (_index_key(index['key']), name,
+                         _index_options(index)) for name, index
+                        in collection.index_information().items()
+                    ]
+                indexes = existing[collection.full_name]
+
+                for keys, options in _declared_indexes(document):
+                    index_background = options.pop('background', background)
+                    index_options = _index_options(options)
+                    found = None
+                    for index in indexes:
+                        if index[0] == keys:
+                            found = index
+                            break
+                    if found is not None and found[2] == index_options:
+                        continue
+                    # a subclass inherits the indexes of its parent
+                    if found is not None:
+                        indexes.remove(found)
+                    indexes.append((keys, None, index_options))
+                    if not dry_run:
+                        if found is not None:
+                            collection.drop_index(found[1])
+                        collection.create_index(
+                            keys, background=index_background, **options
+                        )
+                        app.logger.info('Created index %s on %s', keys,
+                                        collection.full_name)
+                    report.append({'document': document.__name__,
+                                   'collection': collection.full_name,
+                                   'keys': keys, 'options': options,
+                                   'created': not dry_run,
+                                   'changed': found is not None})
+            return report
+        finally:
+            ctx.pop()
+
+    def _ensure_indexes_once(self, app):
+        self._check_pid()
+        self._lock.acquire()
+        try:
+            if app in self._indexed_apps:
+                return
+            self._indexed_apps.add(app)
+        finally:
+            self._lock.release()
+
+        thread = threading.Thread(target=self._ensure_indexes_in_background,
+                                  args=(app,))
+        thread.daemon = True
+        thread.start()
+
+    def _ensure_indexes_in_background(self, app):
+        try:
+            self.ensure_indexes(app)
+        except Exception:
+            app.logger.exception('Creating the indexes failed')
+
+    def _register_commands(self, app): # pragma: no cover
+        import click
 
-            if not auth_success:
-                raise AuthenticationIncorrect('Server authentication failed')
+        @app.cli.command('ensure-indexes')
+        @click.option('--dry-run', is_flag=True,
+                      help='Only show the missing indexes.')
+        def ensure_indexes_command(dry_run):
+            """Create the missing indexes of the registered documents."""
+            for index in self.ensure_indexes(app, dry_run=dry_run):
+                if index['created']:
+                    action = 'Created'
+                elif index['changed']:
+                    action = 'Changed'
+                else:
+                    action = 'Missing'
+                click.echo('%s index %s on %s' % (action, index['keys'],
+                                                  index['collection']))
+
+    def _retire(self, shared):
+        shared.retired = True
+        if not shared.in_use:
+            shared.close()
+
+    @contextmanager
+    def read_preference(self, read_preference):
+        """Override the read preference of the connection and of all
+        document classes in the current context:
+
+        .. code-block:: python
+
+            with db.read_preference('primary'):
+                task = db.Task.get_or_404(task_id)
+
+        :param read_preference: The name of a read preference like
+                                ``'secondaryPreferred'`` or a mode of
+                                :class:`~pymongo.ReadPreference`.
+        """
+        ctx = ctx_stack.top
+        previous = getattr(ctx, 'mongokit_read_preference', None)
+        ctx.mongokit_read_preference = \
+            _resolve_read_preference(read_preference)
+        try:
+            yield
+        finally:
+            ctx.mongokit_read_preference = previous
 
     @property
     def connected(self):
@@ -229,27 +2755,167 @@ class MongoKit(object):
         return getattr(ctx, 'mongokit_connection', None) is not None
 
     def disconnect(self):
-        """Close the connection to your MongoDB."""
+        """Close the connection to your MongoDB. If ``MONGODB_POOL`` is
+        enabled the shared connection stays open and only the socket of the
+        current thread is given back to the pool.
+        """
         if self.connected:
             ctx = ctx_stack.top
-            ctx.mongokit_connection.disconnect()
+            if getattr(ctx, 'mongokit_borrowed', False):
+                # the connections belong to the context of another thread
+                ctx.mongokit_connection.end_request()
+                for database, shared in ctx.mongokit_binds.values():
+                    database.connection.end_request()
+                del ctx.mongokit_borrowed
+            else:
+                self._close(ctx.mongokit_connection, ctx.mongokit_shared)
+                for database, shared in ctx.mongokit_binds.values():
+                    self._close(database.connection, shared)
             del ctx.mongokit_connection
             del ctx.mongokit_database
+            del ctx.mongokit_shared
+            del ctx.mongokit_attributes
+            del ctx.mongokit_items
+            del ctx.mongokit_binds
+            del ctx.mongokit_identity_map
+            del ctx.mongokit_recorder
+            del ctx.mongokit_queries
+            del ctx.mongokit_query_shapes
+            del ctx.mongokit_plan_problems
+
+    def _close(self, connection, shared):
+        if shared is None:
+            connection.disconnect()
+        else:
+            self._release(shared)
+
+    def _get_executor(self, app):
+        self._check_pid()
+        if self._executor is None:
+            self._lock.acquire()
+            try:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        app.config.get('MONGODB_EXECUTOR_WORKERS')
+                    )
+            finally:
+                self._lock.release()
+        return self._executor
+
+    def submit(self, func, *args, **kwargs):
+        """Run ``func(*args, **kwargs)`` in the thread pool of this
+        extension and return a :class:`Future` of its result. The function
+        runs inside an app context of the current application and uses the
+        connection of the current context, so wait for the result before
+        the current context ends. The size of the pool is
+        ``MONGODB_EXECUTOR_WORKERS``.
+        """
+        if not self.connected:
+            self.connect()
+        ctx = ctx_stack.top
+
+        def run():
+            worker_ctx = _new_context(ctx.app)
+            worker_ctx.push()
+            try:
+                _borrow_connection(ctx, ctx_stack.top)
+                return func(*args, **kwargs)
+            finally:
+                worker_ctx.pop()
+
+        return Future(self._get_executor(ctx.app).submit(run))
+
+    def gather(self, *funcs):
+        """Run independent queries concurrently in the thread pool of
+        :meth:`submit` and return their results in the order of ``funcs``.
+        The time of a view with several queries drops to the time of the
+        slowest one. If a function raises an exception the functions which
+        didn't start yet are cancelled. The running ones are waited for,
+        because they use the connection of the current context, and the
+        exception of the first failed function in the order of ``funcs`` is
+        raised here.
+
+        .. code-block:: python
+
+            task, count = db.gather(
+                lambda: db.Task.get_or_404(task_id),
+                lambda: db.Task.find({'done': False}).count()
+            )
+
+        Don't call it from inside a function of the pool, it could wait for
+        threads which are all busy.
+
+        :param funcs: Functions without arguments.
+        """
+        futures = [self.submit(func)._future for func in funcs]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        if pending:
+            for future in pending:
+                future.cancel()
+            wait(pending)
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                # raises the exception of the function
+                future.result()
+        return [future.result() for future in futures]
+
+    @property
+    def aio(self):
+        """The :class:`AsyncMongoKit` of this extension."""
+        return AsyncMongoKit(self)
+
+    def _metrics_view(self):
+        return ctx_stack.top.app.response_class(
+            self.metrics.render(), content_type=self.metrics.content_type
+        )
 
     def _teardown_request(self, response):
+        # after a reconnect or an auth error the credentials are applied
+        # again by the next context
+        ctx = ctx_stack.top
+        if _is_auth_error(response) and self.connected:
+            shared_connections = [ctx.mongokit_shared] + \
+                [shared for database, shared in ctx.mongokit_binds.values()]
+            for shared in shared_connections:
+                if shared is not None:
+                    shared.authenticated = False
+        queries = getattr(ctx, 'mongokit_queries', None)
+        borrowed = getattr(ctx, 'mongokit_borrowed', False)
+        if queries is not None and not borrowed:
+            queries_recorded.send(ctx.app, queries=queries)
+        if not borrowed:
+            self._report_query_plans(ctx)
         self.disconnect()
         return response
 
     def __getattr__(self, name, **kwargs):
+        ctx = ctx_stack.top
+        try:
+            return ctx.mongokit_attributes[name]
+        except (AttributeError, KeyError):
+            pass
+
         if not self.connected:
             self.connect()
 
-        mongokit_database = getattr(ctx_stack.top, "mongokit_database")
-        return getattr(mongokit_database, name)
+        database = ctx.mongokit_database
+        bind = self._document_binds.get(name)
+        if bind is not None:
+            database = self.get_database(bind)
+        value = getattr(database, name)
+        ctx.mongokit_attributes[name] = value
+        return value
 
     def __getitem__(self, name):
+        ctx = ctx_stack.top
+        try:
+            return ctx.mongokit_items[name]
+        except (AttributeError, KeyError):
+            pass
+
         if not self.connected:
             self.connect()
 
-        mongokit_database = getattr(ctx_stack.top, "mongokit_database")
-        return mongokit_database[name]
+        value = ctx.mongokit_database[name]
+        ctx.mongokit_items[name] = value
+        return value
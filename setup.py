@@ -25,6 +25,12 @@ install_requires = [
 if sys.version_info < (2, 6):
     install_requires.append('simplejson')
 
+if sys.version_info < (2, 7):
+    install_requires.append('ordereddict')
+
+if sys.version_info < (3, 2):
+    install_requires.append('futures')
+
 setup(
     name='Flask-MongoKit',
     version='0.6',